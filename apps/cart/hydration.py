@@ -0,0 +1,30 @@
+from goods.sku_cache import get_skus
+
+
+def hydrate_cart(cart_dict):
+    '''
+    根据购物车中{'商品id':'商品数量'}构成的字典,一次性获取所有的商品对象,
+    并计算每种商品的小计,以及所有商品的总件数和总价格
+    :param cart_dict: 从redis中获取的购物车数据,数量为空的商品会被忽略
+    :return: (商品对象列表, 商品总件数, 商品总价格)
+    '''
+    sku_map = get_skus([sku_id for sku_id, count in cart_dict.items() if count])
+
+    skus = []
+    total_count = 0
+    total_price = 0
+    for sku_id, count in cart_dict.items():
+        sku = sku_map.get(int(sku_id))
+        if sku is None or not count: # 商品已经不存在,或者不在购物车中
+            continue
+
+        # 获取此种商品的购买的总数和总价格
+        count = int(count)
+        sku.count = count
+        sku.amount = sku.price * count
+        skus.append(sku)
+
+        total_count += count
+        total_price += sku.amount
+
+    return skus, total_count, total_price
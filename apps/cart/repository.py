@@ -0,0 +1,233 @@
+from django.conf import settings
+from django_redis import get_redis_connection
+
+# 用户的购物车 hash cart_用户id {商品id: 商品数量}
+CART_KEY = 'cart_%d'
+# 用户的浏览记录 list history_用户id [商品id, ...],最近浏览的在最左侧
+HISTORY_KEY = 'history_%d'
+# 保存的浏览记录条数
+HISTORY_LENGTH = settings.USER_HISTORY_LENGTH
+
+# 购物车中商品的总件数 hash cart_meta_用户id {'total': 总件数},和购物车一起由lua脚本原子地修改,
+# 不需要每次都取出购物车中所有商品的数量求和
+CART_META_KEY = 'cart_meta_%d'
+
+# 所有购物车脚本共用的函数,KEYS[1]: 购物车key, KEYS[2]: 总件数key
+# 总件数不存在时(如以前的购物车),由购物车中的数据计算一次
+CART_SCRIPT_PREFIX = '''
+local function load_total()
+    local total = redis.call('hget', KEYS[2], 'total')
+    if total then
+        return tonumber(total)
+    end
+    total = 0
+    for _, count in ipairs(redis.call('hvals', KEYS[1])) do
+        total = total + tonumber(count)
+    end
+    return total
+end
+
+local function save_total(total)
+    if redis.call('exists', KEYS[1]) == 1 then
+        redis.call('hset', KEYS[2], 'total', total)
+    else
+        redis.call('del', KEYS[2])
+    end
+end
+'''
+
+# 向购物车中添加商品,检查库存,ARGV: 商品id, 添加的数量, 商品库存
+# 返回值: {商品的新数量, 购物车中的商品条目数, 商品总件数},库存不足时商品的新数量为-1
+ADD_SCRIPT = CART_SCRIPT_PREFIX + '''
+local total = load_total()
+local old = tonumber(redis.call('hget', KEYS[1], ARGV[1]) or 0)
+local count = old + tonumber(ARGV[2])
+if count > tonumber(ARGV[3]) then
+    return {-1, redis.call('hlen', KEYS[1]), total}
+end
+redis.call('hset', KEYS[1], ARGV[1], count)
+total = total + count - old
+save_total(total)
+return {count, redis.call('hlen', KEYS[1]), total}
+'''
+
+# 修改购物车中商品的数量,ARGV: 商品id1, 数量1, 商品id2, 数量2...
+# 返回值: {购物车中的商品条目数, 商品总件数}
+UPDATE_SCRIPT = CART_SCRIPT_PREFIX + '''
+local total = load_total()
+for i = 1, #ARGV, 2 do
+    local old = tonumber(redis.call('hget', KEYS[1], ARGV[i]) or 0)
+    redis.call('hset', KEYS[1], ARGV[i], ARGV[i + 1])
+    total = total + tonumber(ARGV[i + 1]) - old
+end
+save_total(total)
+return {redis.call('hlen', KEYS[1]), total}
+'''
+
+# 删除购物车中的商品,ARGV: 商品id1, 商品id2...
+# 返回值: {购物车中的商品条目数, 商品总件数}
+DELETE_SCRIPT = CART_SCRIPT_PREFIX + '''
+local total = load_total()
+for i = 1, #ARGV do
+    local old = redis.call('hget', KEYS[1], ARGV[i])
+    if old then
+        redis.call('hdel', KEYS[1], ARGV[i])
+        total = total - tonumber(old)
+    end
+end
+save_total(total)
+return {redis.call('hlen', KEYS[1]), total}
+'''
+
+# 向购物车中添加多个商品,要么全部添加,要么都不添加,ARGV: 商品id1, 数量1, 库存1, 商品id2...
+# 返回值: {库存不足的商品是第几个(都充足时为0), 购物车中的商品条目数, 商品总件数}
+BATCH_ADD_SCRIPT = CART_SCRIPT_PREFIX + '''
+local total = load_total()
+local counts = {}
+for i = 1, #ARGV, 3 do
+    local old = tonumber(redis.call('hget', KEYS[1], ARGV[i]) or 0)
+    local count = (counts[ARGV[i]] or old) + tonumber(ARGV[i + 1])
+    if count > tonumber(ARGV[i + 2]) then
+        return {(i + 2) / 3, redis.call('hlen', KEYS[1]), total}
+    end
+    counts[ARGV[i]] = count
+end
+for sku_id, count in pairs(counts) do
+    total = total + count - tonumber(redis.call('hget', KEYS[1], sku_id) or 0)
+    redis.call('hset', KEYS[1], sku_id, count)
+end
+save_total(total)
+return {0, redis.call('hlen', KEYS[1]), total}
+'''
+
+# 获取商品总件数
+TOTAL_SCRIPT = CART_SCRIPT_PREFIX + '''
+local total = load_total()
+save_total(total)
+return total
+'''
+
+
+class CartRepository(object):
+    '''
+    用户购物车的存取,同一个操作涉及的多个redis命令通过pipeline或者lua脚本一次发送
+    '''
+    def __init__(self, user_id, conn=None):
+        self.conn = conn or get_redis_connection('default')
+        self.key = CART_KEY % user_id
+        self.meta_key = CART_META_KEY % user_id
+
+    def _run(self, script, args=()):
+        return self.conn.register_script(script)(keys=[self.key, self.meta_key], args=list(args))
+
+    def count(self):
+        '''购物车中的商品条目数'''
+        return self.conn.hlen(self.key)
+
+    def total(self):
+        '''购物车中商品的总件数'''
+        total = self.conn.hget(self.meta_key, 'total')
+        if total is not None:
+            return int(total)
+        return self._run(TOTAL_SCRIPT)
+
+    def items(self):
+        '''购物车中所有的商品 {商品id: 数量}'''
+        return {int(sku_id): int(count) for sku_id, count in self.conn.hgetall(self.key).items()}
+
+    def get_counts(self, sku_ids):
+        '''获取多个商品在购物车中的数量,不在购物车中的商品数量为None'''
+        return [int(count) if count else None for count in self.conn.hmget(self.key, sku_ids)]
+
+    def add(self, sku_id, count, stock):
+        '''
+        向购物车中添加商品,添加后的数量不能超过库存
+        :return: (商品的新数量, 购物车中的商品条目数),库存不足时商品的新数量为None
+        '''
+        new_count, lines, total = self._run(ADD_SCRIPT, [sku_id, count, stock])
+        return (new_count if new_count >= 0 else None), lines
+
+    def add_many(self, items):
+        '''
+        向购物车中添加多个商品,任何一个商品添加后的数量超过库存时,所有商品都不添加
+        :param items: [(商品id, 添加的数量, 商品库存), ...]
+        :return: (库存不足的商品id,都充足时为None, 商品总件数)
+        '''
+        args = []
+        for item in items:
+            args.extend(item)
+        failed, lines, total = self._run(BATCH_ADD_SCRIPT, args)
+        return (items[failed - 1][0] if failed else None), total
+
+    def update_many(self, items):
+        '''
+        修改购物车中多个商品的数量
+        :param items: [(商品id, 数量), ...]
+        :return: 购物车中商品的总件数
+        '''
+        args = []
+        for item in items:
+            args.extend(item)
+        lines, total = self._run(UPDATE_SCRIPT, args)
+        return total
+
+    def update(self, sku_id, count):
+        '''
+        修改购物车中商品的数量
+        :return: 购物车中商品的总件数
+        '''
+        return self.update_many([(sku_id, count)])
+
+    def delete(self, sku_id):
+        '''
+        删除购物车中的商品
+        :return: 购物车中商品的总件数
+        '''
+        return self.remove([sku_id])
+
+    def remove(self, sku_ids):
+        '''
+        删除购物车中的多个商品,如下单后
+        :return: 购物车中商品的总件数
+        '''
+        lines, total = self._run(DELETE_SCRIPT, sku_ids)
+        return total
+
+
+class HistoryRepository(object):
+    '''
+    用户浏览记录的存取
+    '''
+    def __init__(self, user_id, conn=None):
+        self.conn = conn or get_redis_connection('default')
+        self.key = HISTORY_KEY % user_id
+
+    def recent(self, count=HISTORY_LENGTH):
+        '''最近浏览的商品id,最近浏览的在前'''
+        return [int(sku_id) for sku_id in self.conn.lrange(self.key, 0, count - 1)]
+
+    def prune(self, sku_ids):
+        '''从浏览记录中删除已经不存在的商品'''
+        if not sku_ids:
+            return
+        pipe = self.conn.pipeline()
+        for sku_id in sku_ids:
+            pipe.lrem(self.key, 0, sku_id)
+        pipe.execute()
+
+
+def record_detail_view(user_id, sku_id):
+    '''
+    用户访问商品详情页时,添加浏览记录并获取购物车中的商品条目数,
+    所有命令在一个pipeline中发送,只需要一次往返
+    :return: 购物车中的商品条目数
+    '''
+    conn = get_redis_connection('default')
+    history_key = HISTORY_KEY % user_id
+
+    pipe = conn.pipeline()
+    pipe.hlen(CART_KEY % user_id)
+    pipe.lrem(history_key, 0, sku_id) # 删除该列表中所有的给定的值
+    pipe.lpush(history_key, sku_id) # 在列表最左侧插入一个数据
+    pipe.ltrim(history_key, 0, HISTORY_LENGTH - 1) # 只保存列表中的前几个数据
+    return pipe.execute()[0]
@@ -1,3 +1,49 @@
-from django.test import TestCase
+from cart.repository import CART_KEY, CART_META_KEY, CartRepository
+from utils.testing import RedisTestCase
 
-# Create your tests here.
+
+class CartRepositoryTest(RedisTestCase):
+    '''购物车的lua脚本,购物车和商品总件数一起原子地修改'''
+    def setUp(self):
+        super().setUp()
+        self.cart = CartRepository(1, self.conn)
+
+    def test_add(self):
+        self.assertEqual(self.cart.add(1, 2, 5), (2, 1))
+        self.assertEqual(self.cart.add(1, 3, 5), (5, 1))
+        # 添加后的数量超过库存,不修改购物车
+        self.assertEqual(self.cart.add(1, 1, 5), (None, 1))
+        self.assertEqual(self.cart.items(), {1: 5})
+        self.assertEqual(self.cart.total(), 5)
+
+    def test_add_many(self):
+        self.cart.add(1, 2, 5)
+        # 任何一个商品库存不足,所有商品都不添加
+        self.assertEqual(self.cart.add_many([(2, 1, 5), (1, 4, 5)]), (1, 2))
+        self.assertEqual(self.cart.items(), {1: 2})
+
+        # 同一个商品出现多次时数量累加
+        self.assertEqual(self.cart.add_many([(3, 1, 5), (1, 2, 5), (1, 1, 5)]), (None, 6))
+        self.assertEqual(self.cart.items(), {1: 5, 3: 1})
+        self.assertEqual(self.cart.add_many([(1, 1, 5)]), (1, 6))
+
+    def test_update_and_remove(self):
+        self.cart.add_many([(1, 2, 10), (2, 3, 10)])
+        self.assertEqual(self.cart.update(1, 5), 8)
+        self.assertEqual(self.cart.update_many([(1, 1), (3, 3)]), 7)
+        self.assertEqual(self.cart.delete(2), 4)
+        # 删除不在购物车中的商品不影响总件数
+        self.assertEqual(self.cart.remove([1, 9]), 3)
+        self.assertEqual(self.cart.remove([3]), 0)
+
+        # 购物车为空时总件数也一起删除
+        self.assertFalse(self.conn.exists(CART_KEY % 1))
+        self.assertFalse(self.conn.exists(CART_META_KEY % 1))
+
+    def test_total_without_meta(self):
+        # 以前的购物车没有保存总件数,第一次读取时计算并保存
+        self.conn.hmset(CART_KEY % 1, {1: 2, 2: 3})
+        self.assertEqual(self.cart.total(), 5)
+        self.assertEqual(self.conn.hget(CART_META_KEY % 1, 'total'), b'5')
+        self.assertEqual(self.cart.add(1, 1, 5), (3, 2))
+        self.assertEqual(self.cart.total(), 6)
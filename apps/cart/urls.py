@@ -1,9 +1,13 @@
 from django.conf.urls import url,include
 from cart.views import CartAddView,CartInfoView,CartUpdateView,CartDeleteView
+from cart.views import CartBatchAddView,CartBatchUpdateView,CartBatchDeleteView
 
 urlpatterns = [
     url(r'^add$',CartAddView.as_view(),name='add'),
     url(r'^$',CartInfoView.as_view(),name='show'),
     url(r'^update$',CartUpdateView.as_view(),name='update'),
     url(r'^delete$',CartDeleteView.as_view(),name='delete'),
+    url(r'^batch_add$',CartBatchAddView.as_view(),name='batch_add'), # 批量添加
+    url(r'^batch_update$',CartBatchUpdateView.as_view(),name='batch_update'), # 批量修改数量
+    url(r'^batch_delete$',CartBatchDeleteView.as_view(),name='batch_delete'), # 批量删除
 ]
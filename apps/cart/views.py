@@ -1,10 +1,11 @@
 from django.shortcuts import render
 from django.http import JsonResponse
 from django.views.generic import View
-from django_redis import get_redis_connection
 from utils.mixin import LoginRequiredMixin
 
-from goods.models import GoodsSKU
+from cart.hydration import hydrate_cart
+from cart.repository import CartRepository
+from goods.sku_cache import get_sku, get_skus
 
 # Create your views here.
 
@@ -28,25 +29,14 @@ class CartAddView(View):
             count = int(count) # 检测商品数量是不是整数
         except Exception as e:
             return JsonResponse({'res': 2, 'errmsg': '商品数目出错'})
-        try:
-            sku = GoodsSKU.objects.get(id=sku_id) # 检测商品是不是存在
-        except GoodsSKU.DoesNotExist:
+        sku = get_sku(sku_id) # 检测商品是不是存在
+        if sku is None:
             return JsonResponse({'res':3, 'errmsg':'商品不存在'})
 
-        # 将商品添加到用户的购物车中
-        sr_conn = get_redis_connection('default')
-        cart_key = 'cart_%d'%user.id
-        cart_count = sr_conn.hget(cart_key,sku_id)
-        if not cart_count:
-            count = count
-        else:
-            count += cart_count
-
-        if count > sku.stock:
+        # 将商品添加到用户的购物车中,检查库存和修改数量在redis中一次完成
+        new_count, total_count = CartRepository(user.id).add(sku_id, count, sku.stock)
+        if new_count is None:
             return JsonResponse({'res': 4, 'errmsg': '商品库存不足'})
-        sr_conn.hset(cart_key, sku_id, count)
-
-        total_count = sr_conn.hlen(cart_key)
 
         return JsonResponse({'res':5,'total_count':total_count,'message':'添加成功'})
 
@@ -62,22 +52,10 @@ class CartInfoView(LoginRequiredMixin,View):
         :return:
         '''
         user = request.user
-        sr_conn = get_redis_connection('default')
-        cart_key = "cart_%d"%user.id
-        cart_dict = sr_conn.hgetall(cart_key)
-
-        skus = []
-        total_count = 0
-        total_price = 0
-        for sku_id,count in cart_dict.items():
-            sku = GoodsSKU.objects.get(id=sku_id)
-            # 获取此种商品的购买的总数和总价格
-            sku.amount = sku.price * int(count)
-            sku.count = count
-            skus.append(sku)
-
-            total_count += int(count)
-            total_price += sku.amount
+        cart_dict = CartRepository(user.id).items()
+
+        # 一次性获取购物车中所有的商品,并计算小计和总计
+        skus, total_count, total_price = hydrate_cart(cart_dict)
 
         context = {
             'total_count': total_count,
@@ -108,24 +86,16 @@ class CartUpdateView(View):
             count = int(count) # 检测商品数量是不是整数
         except Exception as e:
             return JsonResponse({'res': 2, 'errmsg': '商品数目出错'})
-        try:
-            sku = GoodsSKU.objects.get(id=sku_id) # 检测商品是不是存在
-        except GoodsSKU.DoesNotExist:
+        sku = get_sku(sku_id) # 检测商品是不是存在
+        if sku is None:
             return JsonResponse({'res':3, 'errmsg':'商品不存在'})
 
         # 获取商品存货,如果存货小于购买量,返回错误信息
         if count > sku.stock:
             return JsonResponse({'res': 4, 'errmsg': '商品库存不足'})
 
-        cart_key = "cart_%d"%user.id
-        sr_conn = get_redis_connection('default')
-        sr_conn.hset(cart_key, sku_id, count)
-
-        # 计算商品总件数
-        total_count = 0
-        goods_count = sr_conn.hvals(cart_key)
-        for val in goods_count:
-            total_count += int(val)
+        # 修改商品数量,并计算商品总件数
+        total_count = CartRepository(user.id).update(sku_id, count)
 
         return JsonResponse({'res':5, 'total_count':total_count, 'message':'更新成功'})
 
@@ -145,20 +115,108 @@ class CartDeleteView(View):
         if (not sku_id) or (not sku_id.isdigit()): # 如果商品id是空或者不是数字
             return JsonResponse({'res': 1, 'errmsg': '无效的商品id'})
 
-        try:
-            sku = GoodsSKU.objects.get(id=sku_id) # 检测商品是不是存在
-        except GoodsSKU.DoesNotExist:
+        sku = get_sku(sku_id) # 检测商品是不是存在
+        if sku is None:
             return JsonResponse({'res':2, 'errmsg':'商品不存在'})
 
-        # 删除某用户购物车中的商品
-        cart_key = "cart_%d"%user.id
-        sr_conn = get_redis_connection('default')
-        sr_conn.hdel(cart_key,sku_id)
+        # 删除某用户购物车中的商品,并计算商品总件数
+        total_count = CartRepository(user.id).delete(sku_id)
+
+        return JsonResponse({'res':3, 'total_count':total_count, 'message':'删除成功'})
+
+
+def get_batch_items(request, need_count=True):
+    '''
+    获取批量操作的商品,前端传来的sku_ids和counts是一一对应的列表
+    :return: ([(商品id, 数量), ...], None),数据有误时返回(None, 错误信息的JsonResponse)
+    '''
+    sku_ids = request.POST.getlist('sku_ids')
+    counts = request.POST.getlist('counts') if need_count else ['0'] * len(sku_ids)
+
+    # 验证前端穿过来的数据的完整性及合法性
+    if not sku_ids or len(sku_ids) != len(counts):
+        return None, JsonResponse({'res': 1, 'errmsg': '数据不完整'})
+    if not all(sku_id.isdigit() for sku_id in sku_ids):
+        return None, JsonResponse({'res': 1, 'errmsg': '无效的商品id'})
+    try:
+        counts = [int(count) for count in counts] # 检测商品数量是不是整数
+    except Exception as e:
+        return None, JsonResponse({'res': 2, 'errmsg': '商品数目出错'})
+    if need_count and any(count <= 0 for count in counts): # 商品数量必须大于0
+        return None, JsonResponse({'res': 2, 'errmsg': '商品数目出错'})
+
+    return [(int(sku_id), count) for sku_id, count in zip(sku_ids, counts)], None
+
+
+class CartBatchAddView(View):
+    '''
+    一次向购物车中添加多个商品,如再次购买以前订单中的商品,
+    所有商品的库存检查只需要一次查询,所有商品的修改在redis中一次完成
+    '''
+    def post(self,request):
+        user = request.user
+        if not user.is_authenticated:
+            return JsonResponse({'res':0, 'errmsg':'请先登录'})
+
+        items, error = get_batch_items(request)
+        if error:
+            return error
+
+        # 一次性获取所有商品,检测商品是不是存在
+        skus = get_skus([sku_id for sku_id, count in items])
+        if len(skus) != len(set(sku_id for sku_id, count in items)):
+            return JsonResponse({'res':3, 'errmsg':'商品不存在'})
+
+        # 添加后的数量超过库存时,所有商品都不添加
+        failed, total_count = CartRepository(user.id).add_many(
+            [(sku_id, count, skus[sku_id].stock) for sku_id, count in items])
+        if failed is not None:
+            return JsonResponse({'res': 4, 'errmsg': '商品库存不足', 'sku_id': failed})
+
+        return JsonResponse({'res':5, 'total_count':total_count, 'message':'添加成功'})
+
+
+class CartBatchUpdateView(View):
+    '''
+    一次修改购物车中多个商品的数量
+    '''
+    def post(self,request):
+        user = request.user
+        if not user.is_authenticated:
+            return JsonResponse({'res':0, 'errmsg':'请先登录'})
+
+        items, error = get_batch_items(request)
+        if error:
+            return error
+
+        skus = get_skus([sku_id for sku_id, count in items])
+        for sku_id, count in items:
+            if sku_id not in skus:
+                return JsonResponse({'res':3, 'errmsg':'商品不存在'})
+            # 获取商品存货,如果存货小于购买量,返回错误信息
+            if count > skus[sku_id].stock:
+                return JsonResponse({'res': 4, 'errmsg': '商品库存不足', 'sku_id': sku_id})
+
+        # 修改商品数量,并计算商品总件数
+        total_count = CartRepository(user.id).update_many(items)
+
+        return JsonResponse({'res':5, 'total_count':total_count, 'message':'更新成功'})
+
+
+class CartBatchDeleteView(View):
+    '''
+    一次删除购物车中的多个商品,如删除选中的商品
+    '''
+    def post(self,request):
+        user = request.user
+        if not user.is_authenticated: # 用户未登录
+            return JsonResponse({'res': 0, 'errmsg': '请先登录'})
+
+        items, error = get_batch_items(request, need_count=False)
+        if error:
+            return error
 
-        # 计算商品总件数
-        total_count = 0
-        goods_count = sr_conn.hvals(cart_key)
-        for val in goods_count:
-            total_count += int(val)
+        # 删除购物车中的商品,并计算商品总件数,购物车中没有的商品会被忽略
+        total_count = CartRepository(user.id).remove([sku_id for sku_id, count in items])
 
         return JsonResponse({'res':3, 'total_count':total_count, 'message':'删除成功'})
\ No newline at end of file
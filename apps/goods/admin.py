@@ -1,7 +1,8 @@
 from django.contrib import admin
+from django.db import transaction
 from goods.models import GoodsType, GoodsSKU, IndexGoodsBanner,IndexPromotionBanner,IndexTypeGoodsBanner
 from celery_tasks import tasks
-from django.core.cache import cache
+from goods.index_page import refresh_index_body
 
 # Register your models here.
 
@@ -12,20 +13,22 @@ class BaseModelAdmin(admin.ModelAdmin):
         在该管理类关联的表格类中添加数据,或者更新数据时,调用该函数
         '''
         super().save_model(request, obj, form, change)
-        # 发出任务，让celery worker重新生成首页静态页
-        tasks.generate_static_index_html.delay()
-        # 清除首页的缓存
-        cache.delete('index_page_data')
+        # 让celery worker重新生成首页静态页，短时间内的多次修改只生成一次
+        tasks.schedule_static_index_html()
+        # 事务提交后把首页的缓存标记为过期,由下一个请求重新生成,其他请求继续使用旧的缓存,
+        # 提交前标记的话,下一个请求可能读到修改前的数据并重新缓存
+        transaction.on_commit(refresh_index_body)
 
     def delete_model(self, request, obj):
         '''
         在该管理类关联的表格类中删除数据,调用该函数
         '''
         super().delete_model(request, obj)
-        # 发出任务，让celery worker重新生成首页静态页
-        tasks.generate_static_index_html.delay()
-        # 清除首页的缓存
-        cache.delete('index_page_data')
+        # 让celery worker重新生成首页静态页，短时间内的多次修改只生成一次
+        tasks.schedule_static_index_html()
+        # 事务提交后把首页的缓存标记为过期,由下一个请求重新生成,其他请求继续使用旧的缓存,
+        # 提交前标记的话,下一个请求可能读到修改前的数据并重新缓存
+        transaction.on_commit(refresh_index_body)
 
 
 class GoodsTypeAdmin(BaseModelAdmin):
@@ -2,4 +2,8 @@ from django.apps import AppConfig
 
 
 class GoodsConfig(AppConfig):
-    name = 'apps.goods'
+    name = 'goods'
+
+    def ready(self):
+        # 注册商品修改后重新生成静态页面等信号处理函数
+        import goods.signals
@@ -0,0 +1,222 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+
+from goods.models import GoodsSKU, Goods
+from goods.sku_cache import get_skus
+from goods.type_cache import get_types
+from goods import rankings
+from order.models import OrderGoods
+
+# 详情页和列表页展示的新品数量
+NEW_SKUS_COUNT = 2
+# 同一个SPU的所有商品id列表
+SPU_SKUS_KEY = 'spu_skus_%d'
+# SPU的商品详情,商品快照中不包含商品详情
+GOODS_DETAIL_KEY = 'goods_detail_%d'
+# 商品评论的某一页,key中包含版本号,有新的评论时版本号加1,以前缓存的所有页都不再使用
+COMMENTS_KEY = 'sku_comments_%d_%d_%d'
+# 商品评论的总页数,和评论页使用同一个版本号
+COMMENTS_PAGES_KEY = 'sku_comments_pages_%d_%d'
+COMMENTS_VERSION_KEY = 'sku_comments_version_%d'
+CATALOG_CACHE_TIMEOUT = 600
+
+# 列表页的排序方式和对应的种类排行(见goods.rankings),以及没有指定排序方向时的默认方向
+LIST_ORDERINGS = {
+    'default': 'default',
+    'price': 'price',
+    'hot': 'sales',
+    'recent': 'recent',
+}
+LIST_DEFAULT_DIRECTIONS = {
+    'default': 'asc',
+    'price': 'asc',
+    'hot': 'desc',
+    'recent': 'desc',
+}
+
+
+def get_new_skus(type_id):
+    '''获取种类中最新的商品,商品id从种类的新品排行中获取,商品对象从商品缓存中获取'''
+    sku_ids = rankings.get_page(type_id, 'new', True, 0, NEW_SKUS_COUNT)
+    skus = get_skus(sku_ids)
+    return [skus[sku_id] for sku_id in sku_ids if sku_id in skus]
+
+
+def get_spu_skus(goods_id):
+    '''获取同一个SPU的所有商品'''
+    key = SPU_SKUS_KEY % goods_id
+    sku_ids = cache.get(key)
+    if sku_ids is None:
+        sku_ids = list(GoodsSKU.objects.filter(goods_id=goods_id).order_by('id').values_list('id', flat=True))
+        cache.set(key, sku_ids, CATALOG_CACHE_TIMEOUT)
+    skus = get_skus(sku_ids)
+    return [skus[sku_id] for sku_id in sku_ids if sku_id in skus]
+
+
+def get_goods_detail(goods_id):
+    '''获取SPU的商品详情'''
+    key = GOODS_DETAIL_KEY % goods_id
+    detail = cache.get(key)
+    if detail is None:
+        detail = Goods.objects.filter(id=goods_id).values_list('detail', flat=True).first() or ''
+        cache.set(key, detail, CATALOG_CACHE_TIMEOUT)
+    return detail
+
+
+def invalidate_catalog(goods_ids):
+    '''商品或SPU被添加,修改或删除后,删除SPU的商品列表和商品详情'''
+    if goods_ids:
+        cache.delete_many([key % goods_id for goods_id in goods_ids for key in (SPU_SKUS_KEY, GOODS_DETAIL_KEY)])
+
+
+def _comments_version(sku_id):
+    version = cache.get(COMMENTS_VERSION_KEY % sku_id)
+    if version is None:
+        version = 1
+        cache.add(COMMENTS_VERSION_KEY % sku_id, version, None)
+    return version
+
+
+def get_comment_page(sku_id, page):
+    '''
+    获取商品评论的某一页,最新的评论在前
+    :return: {'comments': [{'username','comment','update_time'}, ...], 'number': 页码, 'num_pages': 总页数}
+    '''
+    try:
+        page = max(int(page), 1)
+    except Exception as e:
+        page = 1
+
+    page_size = settings.SKU_COMMENTS_PAGE_SIZE
+    comments = (OrderGoods.objects.filter(sku_id=sku_id).exclude(comment='')
+                .order_by('-update_time').values('order__user__username', 'comment', 'update_time'))
+
+    # 先把页码限制在总页数以内再生成key,超出范围的页码都使用最后一页的缓存
+    version = _comments_version(sku_id)
+    pages_key = COMMENTS_PAGES_KEY % (sku_id, version)
+    num_pages = cache.get(pages_key)
+    if num_pages is None:
+        num_pages = Paginator(comments, page_size).num_pages
+        cache.set(pages_key, num_pages, CATALOG_CACHE_TIMEOUT)
+    page = min(page, num_pages)
+
+    key = COMMENTS_KEY % (sku_id, version, page)
+    data = cache.get(key)
+    if data is None:
+        start = (page - 1) * page_size
+        data = {
+            'comments': [{'username': comment['order__user__username'],
+                          'comment': comment['comment'],
+                          'update_time': comment['update_time']} for comment in comments[start:start + page_size]],
+            'number': page,
+            'num_pages': num_pages,
+        }
+        cache.set(key, data, CATALOG_CACHE_TIMEOUT)
+    return data
+
+
+def invalidate_comments(sku_ids):
+    '''商品有新的评论后,以前缓存的评论页都不再使用'''
+    for sku_id in sku_ids:
+        try:
+            cache.incr(COMMENTS_VERSION_KEY % int(sku_id))
+        except ValueError: # 版本号不存在,还没有缓存过评论
+            pass
+
+
+def get_detail_data(sku, comment_page=1):
+    '''
+    获取商品详情页中与用户无关的数据,详情页视图和静态详情页共用,
+    商品对象需要已经加载了goods和type(见sku_cache),其他数据都从缓存中获取
+    '''
+    # 获取商品详情
+    goods_detail = get_goods_detail(sku.goods_id)
+
+    # 获取所有商品分类
+    types = get_types()
+
+    # 获取当前商品的评论
+    comment_page = get_comment_page(sku.id, comment_page)
+
+    # 获取新品信息
+    new_skus = get_new_skus(sku.type_id)
+
+    # 获取同一个SPU的其他规格商品
+    same_spu_skus = [spu_sku for spu_sku in get_spu_skus(sku.goods_id) if spu_sku.id != sku.id]
+
+    return {
+        'sku':sku,
+        'goods_detail':goods_detail,
+        'types':types,
+        'comment_page':comment_page,
+        'new_skus':new_skus,
+        'same_spu_skus':same_spu_skus,
+    }
+
+
+def get_list_ordering(sort, direction):
+    '''
+    获取列表页使用的种类排行
+    :return: (排序方式, 排序方向, 排行的字段),参数不正确时使用默认值
+    '''
+    if sort not in LIST_ORDERINGS:
+        sort = 'default'
+    if direction not in ('asc', 'desc'):
+        direction = LIST_DEFAULT_DIRECTIONS[sort]
+    return sort, direction, LIST_ORDERINGS[sort]
+
+
+def get_list_data(ctype, sort, direction, page):
+    '''
+    获取商品列表页中与用户无关的数据,列表页视图和静态列表页共用
+    某一页的商品id用ZRANGE从种类的排行中获取(排行建立之前使用mysql的组合索引),
+    商品对象从商品缓存中获取,不需要查询mysql
+    :param sort: 页面上选中的排序方式 default/price/hot/recent
+    :param direction: 排序方向 asc/desc
+    :param page: 页码,超出范围时显示第1页
+    '''
+    # 获取商品种类信息
+    types = get_types()
+
+    # 获取新品信息
+    new_skus = get_new_skus(ctype.id)
+
+    # 生成页码
+    sort, direction, field = get_list_ordering(sort, direction)
+    page_size = settings.GOODS_LIST_PAGE_SIZE
+    num_pages = max((rankings.get_count(ctype.id) + page_size - 1) // page_size, 1)
+    try:
+        page = int(page)
+    except Exception as e:
+        page = 1
+
+    if page > num_pages or page < 1:
+        page = 1
+
+    # 获取某页上的商品
+    sku_ids = rankings.get_page(ctype.id, field, direction == 'desc', (page - 1) * page_size, page_size)
+    sku_map = get_skus(sku_ids)
+    skus = [sku_map[sku_id] for sku_id in sku_ids if sku_id in sku_map]
+
+    # 进行页码的控制，页面上最多显示5个页码
+    if num_pages <= 5:
+        page_range = range(1,num_pages+1)
+    elif page <= 3:
+        page_range = range(1, 6)
+    elif num_pages - page <= 2:
+        page_range = range(num_pages-4,num_pages+1)
+    else:
+        page_range = range(page-2,page+3)
+
+    return {
+        'type':ctype,
+        'types':types,
+        'skus':skus,
+        'page':page,
+        'num_pages':num_pages,
+        'new_skus':new_skus,
+        'sort':sort,
+        'direction':direction,
+        'page_range':page_range,
+    }
@@ -0,0 +1,62 @@
+from django.template import loader
+
+from goods.models import GoodsType, IndexGoodsBanner, IndexPromotionBanner, IndexTypeGoodsBanner
+from utils.single_flight import get_or_rebuild, mark_stale
+
+# 首页中与用户无关的部分渲染后的html在缓存中的key
+INDEX_BODY_KEY = 'index_page_body'
+INDEX_BODY_TIMEOUT = 3600
+
+
+def get_index_data():
+    '''
+    从数据库中获取首页要展示的数据,不管有多少种商品,都只需要4条查询
+    '''
+    # 获取商品的种类信息
+    types = list(GoodsType.objects.all())
+
+    # 获取首页轮播商品信息
+    goods_banners = list(IndexGoodsBanner.objects.select_related('sku').order_by('index'))
+
+    # 获取首页促销活动信息
+    promotion_banners = list(IndexPromotionBanner.objects.all().order_by('index'))
+
+    # 获取首页分类商品展示信息,并给每个分类添加此分类下要展示的商品
+    types_dict = {}
+    for ctype in types:
+        ctype.image_banners = []
+        ctype.title_banners = []
+        types_dict[ctype.id] = ctype
+
+    for banner in IndexTypeGoodsBanner.objects.select_related('sku').order_by('index'):
+        ctype = types_dict.get(banner.type_id)
+        if ctype is None:
+            continue
+        if banner.display_type == 1:
+            ctype.image_banners.append(banner)
+        else:
+            ctype.title_banners.append(banner)
+
+    return {
+        'types': types,
+        'goods_banners': goods_banners,
+        'promotion_banners': promotion_banners
+    }
+
+
+def render_index_body():
+    '''渲染首页中与用户无关的部分'''
+    return loader.render_to_string('index_body.html', get_index_data())
+
+
+def get_index_body():
+    '''
+    获取首页中与用户无关的部分渲染后的html,缓存失效时只有一个请求重新渲染,
+    其他请求继续使用之前渲染的html
+    '''
+    return get_or_rebuild(INDEX_BODY_KEY, render_index_body, INDEX_BODY_TIMEOUT)
+
+
+def refresh_index_body():
+    '''首页的数据被修改后调用,下一次访问首页时重新渲染'''
+    mark_stale(INDEX_BODY_KEY)
@@ -0,0 +1,89 @@
+'''
+中文分词的性能测试,比较:
+    1.没有词典缓存文件和有缓存文件时加载jieba词典的时间
+    2.第一次(冷)和再次(热,使用utils.analyzer中缓存的分词结果)对查询词分词的时间
+
+    python manage.py benchmark_analyzer                  # 使用商品名称作为查询词
+    python manage.py benchmark_analyzer --queries q.txt  # 每行一个查询词
+    python manage.py benchmark_analyzer --build-cache    # 只重新生成词典缓存文件,部署时使用
+'''
+import os
+import tempfile
+import time
+
+import jieba
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from goods.models import GoodsSKU
+from utils import analyzer
+
+
+def _load_time(cache_file):
+    '''用一个新的jieba分词器加载词典,返回加载的秒数'''
+    tokenizer = jieba.Tokenizer()
+    tokenizer.cache_file = cache_file
+    start = time.perf_counter()
+    tokenizer.initialize()
+    return time.perf_counter() - start
+
+
+def _latencies(queries):
+    '''对每个查询词分词,返回每次分词的毫秒数'''
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        analyzer.tokenize(query)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+class Command(BaseCommand):
+    help = '比较jieba词典冷/热加载,以及查询词冷/热分词的耗时'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queries', help='查询词文件,每行一个查询词,默认使用商品名称')
+        parser.add_argument('--limit', type=int, default=1000, help='最多使用的查询词数')
+        parser.add_argument('--build-cache', action='store_true', help='只重新生成词典缓存文件')
+
+    def handle(self, *args, **options):
+        if options['build_cache']:
+            if os.path.exists(settings.JIEBA_CACHE_FILE):
+                os.remove(settings.JIEBA_CACHE_FILE)
+            seconds = _load_time(settings.JIEBA_CACHE_FILE)
+            self.stdout.write(self.style.SUCCESS('已生成%s,耗时%.2fs' % (settings.JIEBA_CACHE_FILE, seconds)))
+            return
+
+        # 词典加载:没有缓存文件时从词典文本生成,有缓存文件时直接读取
+        tmp_dir = tempfile.mkdtemp()
+        tmp_cache = os.path.join(tmp_dir, 'jieba.cache')
+        try:
+            cold_load = _load_time(tmp_cache)
+            warm_load = _load_time(tmp_cache)
+        finally:
+            if os.path.exists(tmp_cache):
+                os.remove(tmp_cache)
+            os.rmdir(tmp_dir)
+        self.stdout.write('词典加载: 没有缓存文件 %.2fs, 有缓存文件 %.2fs' % (cold_load, warm_load))
+
+        # 查询词分词
+        if options['queries']:
+            with open(options['queries'], encoding='utf-8') as f:
+                queries = [line.strip() for line in f if line.strip()]
+        else:
+            queries = list(GoodsSKU.objects.values_list('name', flat=True))
+        queries = queries[:options['limit']]
+        if not queries:
+            self.stdout.write('没有查询词')
+            return
+
+        analyzer.warm_up()
+        analyzer.clear_memo()
+        cold = sorted(_latencies(queries))
+        warm = sorted(_latencies(queries))
+
+        for name, latencies in (('冷', cold), ('热', warm)):
+            self.stdout.write('%s分词: %d个查询词, 平均 %.3fms, p95 %.3fms, 最大 %.3fms' % (
+                name, len(latencies), sum(latencies) / len(latencies),
+                latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)], latencies[-1]))
+        self.stdout.write('分词缓存: %s' % (analyzer.memo_info(),))
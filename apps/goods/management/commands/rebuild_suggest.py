@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from goods import suggest
+
+
+class Command(BaseCommand):
+    help = '从mysql中重建搜索框输入提示的索引,之后由商品的信号增量更新'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='每次写入redis的商品数')
+
+    def handle(self, *args, **options):
+        count = suggest.rebuild(options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS('重建了%d个商品的输入提示' % count))
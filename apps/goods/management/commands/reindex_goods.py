@@ -0,0 +1,180 @@
+'''
+重建或增量更新商品的全文检索索引,代替haystack的rebuild_index/update_index:
+
+    python manage.py reindex_goods                  # 多进程重建全部索引
+    python manage.py reindex_goods --workers 8      # 指定进程数
+    python manage.py reindex_goods --since "2019-12-10 00:00:00"  # 只更新这个时间之后修改过的商品
+
+重建时按id顺序把商品分成若干段,每个进程把一段商品写入单独的临时whoosh索引,
+全部完成后合并到正式的索引中。每完成一段就记录到检查点文件中,
+中断后再次执行时跳过已经完成的段,使用--restart忽略检查点重新开始
+'''
+import json
+import os
+import shutil
+from datetime import datetime
+from multiprocessing import Pool
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections as db_connections
+from django.utils import timezone
+from haystack import connections
+
+from goods.models import GoodsSKU
+
+# 临时索引的目录和检查点文件,都在正式索引的目录中
+TMP_DIR = '.reindex_tmp'
+CHECKPOINT_FILE = '.reindex_checkpoint'
+
+
+def _get_index(using):
+    backend = connections[using].get_backend()
+    backend.setup()
+    index = connections[using].get_unified_index().get_index(GoodsSKU)
+    return backend, index
+
+
+def _index_chunk(args):
+    '''
+    在子进程中把一段商品写入单独的临时whoosh索引
+    :param args: (使用的haystack连接, 起始商品id, 结束商品id, 临时索引的目录)
+    :return: (起始商品id, 结束商品id, 临时索引的目录, 写入的商品数)
+    '''
+    from whoosh import index as whoosh_index
+
+    using, start_id, end_id, path = args
+    backend, index = _get_index(using)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    ix = whoosh_index.create_in(path, backend.schema)
+    writer = ix.writer()
+
+    count = 0
+    skus = index.index_queryset(using).filter(id__gte=start_id, id__lte=end_id).order_by('id')
+    for sku in skus.iterator():
+        # 和WhooshSearchBackend.update中对每个对象的处理相同
+        doc = index.full_prepare(sku)
+        doc = {key: backend._from_python(value) for key, value in doc.items() if key != 'boost'}
+        writer.add_document(**doc)
+        count += 1
+
+    writer.commit()
+    return start_id, end_id, path, count
+
+
+class Command(BaseCommand):
+    help = '多进程重建商品的全文检索索引,或者增量更新某个时间之后修改过的商品'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--using', default='default', help='haystack的连接名')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='重建索引的进程数')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='每一段的商品数')
+        parser.add_argument('--since', help='只更新这个时间(update_time)之后修改过的商品,格式: 2019-12-10 00:00:00')
+        parser.add_argument('--restart', action='store_true', help='忽略检查点,重新开始')
+
+    def handle(self, *args, **options):
+        self.using = options['using']
+        self.chunk_size = options['chunk_size']
+        self.index_path = connections[self.using].options['PATH']
+        self.checkpoint_path = os.path.join(self.index_path, CHECKPOINT_FILE)
+        os.makedirs(self.index_path, exist_ok=True)
+
+        if options['restart'] and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+        if options['since']:
+            try:
+                since = datetime.strptime(options['since'], '%Y-%m-%d %H:%M:%S')
+            except ValueError:
+                raise CommandError('--since的格式为: 2019-12-10 00:00:00')
+            self.update_since(timezone.make_aware(since))
+        else:
+            self.rebuild(options['workers'])
+
+    def load_checkpoint(self, mode):
+        '''读取检查点,检查点不是同一种操作时忽略'''
+        try:
+            with open(self.checkpoint_path) as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return checkpoint if checkpoint.get('mode') == mode else {}
+
+    def save_checkpoint(self, checkpoint):
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def iter_chunks(self, queryset, after_id=0):
+        '''按id顺序把商品分段,每次只查询一段商品的id,返回(起始id, 结束id)'''
+        while True:
+            ids = list(queryset.filter(id__gt=after_id).order_by('id').values_list('id', flat=True)[:self.chunk_size])
+            if not ids:
+                return
+            yield ids[0], ids[-1]
+            after_id = ids[-1]
+
+    def rebuild(self, workers):
+        from whoosh import index as whoosh_index
+
+        # 检查点中保存了分好的段和已经完成的段,恢复时使用相同的分段,之后新增的商品分到新的段中
+        tmp_root = os.path.join(self.index_path, TMP_DIR)
+        checkpoint = self.load_checkpoint('rebuild') or {'mode': 'rebuild', 'chunks': [], 'done': []}
+        last_id = max([end_id for start_id, end_id, path in checkpoint['chunks']] or [0])
+        for start_id, end_id in self.iter_chunks(GoodsSKU.objects.all(), last_id):
+            checkpoint['chunks'].append([start_id, end_id, os.path.join(tmp_root, '%d_%d' % (start_id, end_id))])
+        checkpoint['done'] = [path for path in checkpoint['done'] if os.path.isdir(path)]
+        self.save_checkpoint(checkpoint)
+
+        tasks = [(self.using, start_id, end_id, path)
+                 for start_id, end_id, path in checkpoint['chunks'] if path not in checkpoint['done']]
+        self.stdout.write('共%d段,已完成%d段' % (len(checkpoint['chunks']), len(checkpoint['done'])))
+
+        # 子进程会继承数据库连接,fork之前先关闭
+        db_connections.close_all()
+        with Pool(max(workers, 1)) as pool:
+            for start_id, end_id, path, count in pool.imap_unordered(_index_chunk, tasks):
+                checkpoint['done'].append(path)
+                self.save_checkpoint(checkpoint)
+                self.stdout.write('商品%d-%d: %d个' % (start_id, end_id, count))
+
+        # 新建正式的索引,把所有临时索引合并进来
+        backend, index = _get_index(self.using)
+        ix = whoosh_index.create_in(self.index_path, backend.schema)
+        writer = ix.writer()
+        readers = []
+        for start_id, end_id, path in checkpoint['chunks']:
+            tmp_ix = whoosh_index.open_dir(path)
+            reader = tmp_ix.reader()
+            readers.append(reader)
+            writer.add_reader(reader)
+        writer.commit(optimize=True)
+        for reader in readers:
+            reader.close()
+
+        shutil.rmtree(tmp_root, ignore_errors=True)
+        os.remove(self.checkpoint_path)
+        self.stdout.write(self.style.SUCCESS('索引重建完成'))
+
+    def update_since(self, since):
+        '''增量更新,修改过的商品可能已经在索引中,用backend.update按唯一id覆盖,不能合并临时索引'''
+        key = since.isoformat()
+        checkpoint = self.load_checkpoint('update')
+        after_id = checkpoint.get('last_id', 0) if checkpoint.get('since') == key else 0
+
+        backend, index = _get_index(self.using)
+        skus = index.index_queryset(self.using).filter(**{'%s__gte' % index.get_updated_field(): since})
+
+        total = 0
+        for start_id, end_id in self.iter_chunks(skus, after_id):
+            chunk = list(skus.filter(id__gte=start_id, id__lte=end_id).order_by('id'))
+            backend.update(index, chunk)
+            total += len(chunk)
+            self.save_checkpoint({'mode': 'update', 'since': key, 'last_id': end_id})
+            self.stdout.write('商品%d-%d: %d个' % (start_id, end_id, len(chunk)))
+
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        self.stdout.write(self.style.SUCCESS('更新了%d个商品的索引' % total))
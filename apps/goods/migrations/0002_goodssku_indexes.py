@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('goods', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='goodssku',
+            index=models.Index(fields=['type', 'price'], name='df_goods_sku_type_price'),
+        ),
+        migrations.AddIndex(
+            model_name='goodssku',
+            index=models.Index(fields=['type', 'sales'], name='df_goods_sku_type_sales'),
+        ),
+        migrations.AddIndex(
+            model_name='goodssku',
+            index=models.Index(fields=['type', 'create_time'], name='df_goods_sku_type_ctime'),
+        ),
+    ]
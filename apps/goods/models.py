@@ -41,6 +41,12 @@ class GoodsSKU(BaseModel):
         db_table = 'df_goods_sku'
         verbose_name = '商品'
         verbose_name_plural = verbose_name
+        # 种类排行(见goods.rankings)建立之前,列表页和新品按种类查询并排序
+        indexes = [
+            models.Index(fields=['type', 'price'], name='df_goods_sku_type_price'),
+            models.Index(fields=['type', 'sales'], name='df_goods_sku_type_sales'),
+            models.Index(fields=['type', 'create_time'], name='df_goods_sku_type_ctime'),
+        ]
 
 
 class Goods(BaseModel):
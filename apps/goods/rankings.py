@@ -0,0 +1,232 @@
+'''
+每个种类的商品排行,保存在redis的有序集合中,列表页和新品推荐直接用ZRANGE分页,
+不需要在mysql中排序,种类中的商品再多,取出一页的时间也几乎不变
+
+    type_rank_种类id_default  分数都是0,按成员(补零的商品id)排序,即按id排序
+    type_rank_种类id_price    分数是价格
+    type_rank_种类id_sales    分数是销量
+    type_rank_种类id_new      分数是创建时间
+
+分数相同时redis按成员的字典序排序,成员使用补零的商品id,字典序就是id的顺序
+
+按近期销量(recent)排序时,使用最近SALES_HOT_DAYS天的按天销量(见order.sales)合并后的结果
+
+商品被添加,修改或删除时由goods.signals更新,提交订单时增加销量,
+RANKINGS_REBUILD_INTERVAL秒从mysql中重建一次,修正可能的偏差
+
+种类的排行还没有建立时(如redis被清空后),由celery在后台建立,不在请求中扫描整个种类,
+建立完成之前从mysql中排序分页,使用(种类, 排序字段)的组合索引(见GoodsSKU.Meta.indexes)
+'''
+from django.conf import settings
+from django_redis import get_redis_connection
+
+from goods.models import GoodsSKU
+from order.sales import get_unflushed_sales, get_recent_sales_key
+
+RANK_KEY = 'type_rank_%d_%s'
+RANK_FIELDS = ('default', 'price', 'sales', 'new')
+# 已经建立了排行的种类,种类中没有商品时有序集合不存在,用这个集合区分没有建立和没有商品
+RANK_BUILT_KEY = 'type_rank_built'
+# 正在后台建立排行的种类,这段时间内不再发出建立排行的任务
+RANK_BUILDING_KEY = 'type_rank_building_%d'
+RANK_BUILDING_TIMEOUT = 60
+# 重建时先写入临时的key,完成后再替换正式的key,重建过程中分页不受影响
+RANK_TMP_KEY = 'type_rank_%d_%s_tmp'
+# 被修改过排行的商品id,重建开始时清空,替换正式的key之后重新更新这些商品
+RANK_CHANGED_KEY = 'type_rank_changed_%d'
+RANK_CHANGED_TIMEOUT = 3600
+# 排行还没有建立时,mysql中对应的排序字段,分数相同时和redis一样按商品id排序,
+# 近期销量在mysql中没有统计,使用总销量
+RANK_ORDERINGS = {
+    'default': ('id',),
+    'price': ('price', 'id'),
+    'sales': ('sales', 'id'),
+    'new': ('create_time', 'id'),
+    'recent': ('sales', 'id'),
+}
+
+
+def _member(sku_id):
+    return '%010d' % int(sku_id)
+
+
+def _scores(sku, unflushed=0):
+    return {
+        'default': 0,
+        'price': float(sku.price),
+        'sales': sku.sales + unflushed,
+        'new': sku.create_time.timestamp(),
+    }
+
+
+def _add(pipe, sku, unflushed=0):
+    member = _member(sku.id)
+    for field, score in _scores(sku, unflushed).items():
+        pipe.zadd(RANK_KEY % (sku.type_id, field), {member: score})
+
+
+def _remove(pipe, type_id, sku_id):
+    member = _member(sku_id)
+    for field in RANK_FIELDS:
+        pipe.zrem(RANK_KEY % (type_id, field), member)
+
+
+def _mark_changed(pipe, type_id, sku_id):
+    key = RANK_CHANGED_KEY % type_id
+    pipe.sadd(key, sku_id)
+    pipe.expire(key, RANK_CHANGED_TIMEOUT)
+
+
+def _write_chunk(conn, type_id, mappings):
+    pipe = conn.pipeline(transaction=False)
+    for field, mapping in mappings.items():
+        if mapping:
+            pipe.zadd(RANK_TMP_KEY % (type_id, field), mapping)
+    pipe.execute()
+
+
+def rebuild_type(type_id, conn=None, chunk_size=1000):
+    '''
+    从mysql中重建某个种类的所有排行,销量要加上还没有同步到mysql中的销量,
+    每chunk_size个商品用一条ZADD写入临时的key,完成后用RENAME替换正式的key,
+    重建过程中被修改的商品,替换后再更新一次
+    :return: 种类中的商品数
+    '''
+    conn = conn or get_redis_connection('default')
+    pipe = conn.pipeline()
+    pipe.delete(*[RANK_TMP_KEY % (type_id, field) for field in RANK_FIELDS])
+    pipe.delete(RANK_CHANGED_KEY % type_id)
+    pipe.execute()
+
+    unflushed = get_unflushed_sales(conn)
+    skus = GoodsSKU.objects.filter(type_id=type_id).only('id', 'type_id', 'price', 'sales', 'create_time')
+    count = 0
+    mappings = {field: {} for field in RANK_FIELDS}
+    for sku in skus.order_by('id').iterator():
+        member = _member(sku.id)
+        for field, score in _scores(sku, unflushed.get(sku.id, 0)).items():
+            mappings[field][member] = score
+        count += 1
+        if count % chunk_size == 0:
+            _write_chunk(conn, type_id, mappings)
+            mappings = {field: {} for field in RANK_FIELDS}
+    _write_chunk(conn, type_id, mappings)
+
+    # 在一个事务中替换正式的key,种类中没有商品时临时的key不存在,直接删除正式的key
+    pipe = conn.pipeline()
+    for field in RANK_FIELDS:
+        if count:
+            pipe.rename(RANK_TMP_KEY % (type_id, field), RANK_KEY % (type_id, field))
+        else:
+            pipe.delete(RANK_KEY % (type_id, field))
+    pipe.sadd(RANK_BUILT_KEY, type_id)
+    pipe.delete(RANK_BUILDING_KEY % type_id)
+    pipe.smembers(RANK_CHANGED_KEY % type_id)
+    pipe.delete(RANK_CHANGED_KEY % type_id)
+    changed = [int(sku_id) for sku_id in pipe.execute()[-2]]
+
+    if changed:
+        unflushed = get_unflushed_sales(conn, changed)
+        skus = GoodsSKU.objects.only('id', 'type_id', 'price', 'sales', 'create_time').in_bulk(changed)
+        pipe = conn.pipeline()
+        for sku_id in changed:
+            sku = skus.get(sku_id)
+            if sku is not None and sku.type_id == type_id:
+                _add(pipe, sku, unflushed.get(sku_id, 0))
+            else: # 商品被删除或者换了种类
+                _remove(pipe, type_id, sku_id)
+        pipe.execute()
+    return count
+
+
+def rebuild_all():
+    '''重建所有种类的排行,由celery定时执行'''
+    conn = get_redis_connection('default')
+    type_ids = set(GoodsSKU.objects.values_list('type_id', flat=True).distinct())
+    type_ids.update(int(type_id) for type_id in conn.smembers(RANK_BUILT_KEY))
+    for type_id in type_ids:
+        rebuild_type(type_id, conn)
+
+
+def update_sku(sku, old_type_id=None):
+    '''商品被添加或修改后,更新所在种类的排行,商品换了种类时从原来种类的排行中删除'''
+    conn = get_redis_connection('default')
+    unflushed = get_unflushed_sales(conn, [sku.id]).get(sku.id, 0)
+
+    pipe = conn.pipeline()
+    if old_type_id is not None and old_type_id != sku.type_id:
+        _remove(pipe, old_type_id, sku.id)
+        _mark_changed(pipe, old_type_id, sku.id)
+    _add(pipe, sku, unflushed)
+    _mark_changed(pipe, sku.type_id, sku.id)
+    pipe.execute()
+
+
+def remove_sku(type_id, sku_id):
+    '''商品被删除后,从所在种类的排行中删除'''
+    pipe = get_redis_connection('default').pipeline()
+    _remove(pipe, type_id, sku_id)
+    _mark_changed(pipe, type_id, sku_id)
+    pipe.execute()
+
+
+def incr_sales(items):
+    '''
+    提交订单后增加商品在销量排行中的分数
+    :param items: [(种类id, 商品id, 销量), ...]
+    '''
+    pipe = get_redis_connection('default').pipeline(transaction=False)
+    for type_id, sku_id, count in items:
+        pipe.zincrby(RANK_KEY % (type_id, 'sales'), count, _member(sku_id))
+        _mark_changed(pipe, type_id, sku_id)
+    pipe.execute()
+
+
+def _is_built(conn, type_id):
+    '''种类的排行是否已经建立,没有建立时发出在后台建立排行的任务'''
+    if conn.sismember(RANK_BUILT_KEY, type_id):
+        return True
+    if conn.set(RANK_BUILDING_KEY % type_id, 1, ex=RANK_BUILDING_TIMEOUT, nx=True):
+        from celery_tasks.tasks import rebuild_type_rankings
+        rebuild_type_rankings.delay(type_id)
+    return False
+
+
+def get_count(type_id):
+    '''种类中的商品数'''
+    conn = get_redis_connection('default')
+    if not _is_built(conn, type_id):
+        return GoodsSKU.objects.filter(type_id=type_id).count()
+    return conn.zcard(RANK_KEY % (type_id, 'default'))
+
+
+def _sql_page(type_id, field, desc, offset, count):
+    '''
+    排行建立之前从mysql中获取一段商品id,按(种类, 排序字段)的组合索引排序,
+    销量不包括还没有同步到mysql中的销量
+    '''
+    ordering = [('-' if desc else '') + name for name in RANK_ORDERINGS[field]]
+    skus = GoodsSKU.objects.filter(type_id=type_id).order_by(*ordering)
+    return list(skus.values_list('id', flat=True)[offset:offset + count])
+
+
+def get_page(type_id, field, desc, offset, count):
+    '''
+    获取种类排行中的一段商品id
+    :param field: 排行的字段 default/price/sales/new,或者按近期销量排序 recent
+    :param desc: 是否从大到小排序
+    :return: 商品id的列表
+    '''
+    conn = get_redis_connection('default')
+    if not _is_built(conn, type_id):
+        return _sql_page(type_id, field, desc, offset, count)
+    if field == 'recent':
+        # 合并时包括种类中的所有商品,最近没有销量的商品排在后面
+        key = get_recent_sales_key(type_id, settings.SALES_HOT_DAYS, RANK_KEY % (type_id, 'default'))
+    else:
+        key = RANK_KEY % (type_id, field)
+    if desc:
+        members = conn.zrevrange(key, offset, offset + count - 1)
+    else:
+        members = conn.zrange(key, offset, offset + count - 1)
+    return [int(member) for member in members]
@@ -0,0 +1,79 @@
+'''
+商品搜索,代替haystack自带的搜索视图:
+    1.查询词规范化(全角转半角,大写转小写,合并空白)后,把匹配的商品id列表缓存在redis中一小段时间,
+      热门的查询词不需要每次都查询whoosh索引
+    2.只取出当前页的商品对象,从商品缓存中一次取出
+    3.统计缓存的命中率和查询词的次数,见get_stats
+'''
+import hashlib
+import re
+import unicodedata
+
+from django.conf import settings
+from django.core.cache import cache
+from django_redis import get_redis_connection
+from haystack.query import SearchQuerySet
+
+from goods.models import GoodsSKU
+
+# 查询词匹配的商品id列表
+SEARCH_CACHE_KEY = 'search_ids_%s'
+# 缓存命中和未命中的次数 {'hits': 次数, 'misses': 次数}
+SEARCH_STATS_KEY = 'search_cache_stats'
+# 每个查询词的查询次数 {查询词: 次数},查询词超过SEARCH_QUERY_MAX_LENGTH时只记录前面的部分,
+# 查询词的个数超过SEARCH_QUERIES_KEEP的两倍时,只保留次数最多的SEARCH_QUERIES_KEEP个
+SEARCH_QUERIES_KEY = 'search_query_counts'
+
+
+def normalize_query(query):
+    '''规范化查询词,写法不同但是含义相同的查询词使用同一个缓存'''
+    query = unicodedata.normalize('NFKC', query or '')
+    return re.sub(r'\s+', ' ', query).strip().lower()
+
+
+def _record(query, hit):
+    conn = get_redis_connection('default')
+    pipe = conn.pipeline(transaction=False)
+    pipe.hincrby(SEARCH_STATS_KEY, 'hits' if hit else 'misses', 1)
+    pipe.zincrby(SEARCH_QUERIES_KEY, 1, query[:settings.SEARCH_QUERY_MAX_LENGTH])
+    pipe.zcard(SEARCH_QUERIES_KEY)
+    count = pipe.execute()[-1]
+
+    # 不是每次都删除次数少的查询词,新的查询词有机会累加次数
+    if count > settings.SEARCH_QUERIES_KEEP * 2:
+        conn.zremrangebyrank(SEARCH_QUERIES_KEY, 0, -settings.SEARCH_QUERIES_KEEP - 1)
+
+
+def search_ids(query):
+    '''
+    获取查询词匹配的商品id列表,按相关度排序,最多SEARCH_MAX_RESULTS个
+    :param query: 规范化后的查询词
+    '''
+    key = SEARCH_CACHE_KEY % hashlib.md5(query.encode('utf-8')).hexdigest()
+    sku_ids = cache.get(key)
+    _record(query, sku_ids is not None)
+    if sku_ids is None:
+        results = SearchQuerySet().models(GoodsSKU).auto_query(query)[:settings.SEARCH_MAX_RESULTS]
+        sku_ids = [int(result.pk) for result in results]
+        cache.set(key, sku_ids, settings.SEARCH_CACHE_TIMEOUT)
+    return sku_ids
+
+
+def get_stats(top=100):
+    '''
+    搜索缓存的统计信息
+    :return: {'hits': 命中次数, 'misses': 未命中次数, 'hit_ratio': 命中率, 'top_queries': [(查询词, 次数), ...]}
+    '''
+    conn = get_redis_connection('default')
+    pipe = conn.pipeline(transaction=False)
+    pipe.hmget(SEARCH_STATS_KEY, ['hits', 'misses'])
+    pipe.zrevrange(SEARCH_QUERIES_KEY, 0, top - 1, withscores=True)
+    (hits, misses), top_queries = pipe.execute()
+
+    hits, misses = int(hits or 0), int(misses or 0)
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': hits / (hits + misses) if hits + misses else 0,
+        'top_queries': [(query.decode(), int(count)) for query, count in top_queries],
+    }
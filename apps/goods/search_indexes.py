@@ -11,6 +11,10 @@ class GoodsSKUIndex(indexes.SearchIndex, indexes.Indexable):
         # 返回你的模型类
         return GoodsSKU
 
-    # 建立索引的数据
+    # 建立索引的数据,索引模板中用到了商品的SPU(商品详情),一起查询出来
     def index_queryset(self, using=None):
-        return self.get_model().objects.all()
\ No newline at end of file
+        return self.get_model().objects.select_related('goods')
+
+    # 增量更新索引时(update_index --age, reindex_goods --since),根据这个字段判断商品是否被修改过
+    def get_updated_field(self):
+        return 'update_time'
@@ -0,0 +1,118 @@
+'''
+全文检索索引的异步更新,代替haystack的RealtimeSignalProcessor:
+商品被修改时只在redis中记录商品id,由celery定时批量更新whoosh索引(见update_dirty_index),
+保存商品的请求不需要等待写入索引,也不会在whoosh的写锁上排队
+
+只修改了库存,销量等不在索引中的字段时,不需要更新索引
+'''
+import hashlib
+
+from django.db.models import signals
+from django_redis import get_redis_connection
+from haystack import connections
+from haystack.signals import BaseSignalProcessor
+
+from goods.models import GoodsSKU, Goods
+
+# 需要更新索引的商品id
+DIRTY_KEY = 'search_index_dirty'
+# 商品上一次更新索引时索引字段的摘要 {商品id: 摘要}
+DIGEST_KEY = 'search_index_digest'
+
+# 只修改这些字段时不需要更新索引
+NON_INDEXED_FIELDS = {'stock', 'sales', 'update_time'}
+
+
+def _digest(sku):
+    '''
+    商品在索引中的字段(见templates/search/indexes/goods/goodssku_text.txt)的摘要,
+    商品详情在SPU中,SPU被修改时单独处理
+    '''
+    text = '\n'.join([sku.name, sku.desc, str(sku.goods_id)])
+    return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+
+def mark_dirty(sku_ids):
+    '''记录需要更新索引的商品'''
+    if sku_ids:
+        get_redis_connection('default').sadd(DIRTY_KEY, *sku_ids)
+
+
+class QueuedSignalProcessor(BaseSignalProcessor):
+    '''
+    商品被添加,修改或删除时,把商品id记录到redis中,不直接更新索引
+    '''
+    def setup(self):
+        signals.post_save.connect(self.handle_save, sender=GoodsSKU)
+        signals.post_delete.connect(self.handle_delete, sender=GoodsSKU)
+        signals.post_save.connect(self.handle_goods_save, sender=Goods)
+
+    def teardown(self):
+        signals.post_save.disconnect(self.handle_save, sender=GoodsSKU)
+        signals.post_delete.disconnect(self.handle_delete, sender=GoodsSKU)
+        signals.post_save.disconnect(self.handle_goods_save, sender=Goods)
+
+    def handle_save(self, sender, instance, **kwargs):
+        # save(update_fields=[...])只修改了不在索引中的字段
+        update_fields = kwargs.get('update_fields')
+        if update_fields and set(update_fields) <= NON_INDEXED_FIELDS:
+            return
+
+        # 后台保存商品时会保存所有字段,比较索引字段的摘要判断是否需要更新索引
+        conn = get_redis_connection('default')
+        digest = _digest(instance)
+        old_digest = conn.hget(DIGEST_KEY, instance.id)
+        if old_digest is not None and old_digest.decode() == digest:
+            return
+
+        pipe = conn.pipeline()
+        pipe.hset(DIGEST_KEY, instance.id, digest)
+        pipe.sadd(DIRTY_KEY, instance.id)
+        pipe.execute()
+
+    def handle_delete(self, sender, instance, **kwargs):
+        conn = get_redis_connection('default')
+        pipe = conn.pipeline()
+        pipe.hdel(DIGEST_KEY, instance.id)
+        pipe.sadd(DIRTY_KEY, instance.id)
+        pipe.execute()
+
+    def handle_goods_save(self, sender, instance, **kwargs):
+        # 商品详情在SPU中,SPU修改后这个SPU下的所有商品都要更新索引
+        mark_dirty(list(GoodsSKU.objects.filter(goods=instance).values_list('id', flat=True)))
+
+
+def update_dirty_index(batch_size=500, using='default'):
+    '''
+    批量更新被修改的商品的索引,由celery定时执行,
+    每一批商品只打开一次whoosh的writer,更新失败时商品id放回redis中,下一次重试
+    :return: 更新的商品数
+    '''
+    conn = get_redis_connection('default')
+    backend = connections[using].get_backend()
+    index = connections[using].get_unified_index().get_index(GoodsSKU)
+
+    total = 0
+    while True:
+        sku_ids = [int(sku_id) for sku_id in conn.spop(DIRTY_KEY, batch_size)]
+        if not sku_ids:
+            break
+
+        try:
+            skus = list(index.index_queryset(using).filter(id__in=sku_ids))
+            if skus:
+                backend.update(index, skus)
+
+            # 已经被删除的商品,从索引中删除
+            deleted_ids = set(sku_ids) - set(sku.id for sku in skus)
+            for sku_id in deleted_ids:
+                backend.remove('goods.goodssku.%d' % sku_id)
+        except Exception:
+            conn.sadd(DIRTY_KEY, *sku_ids)
+            raise
+
+        total += len(sku_ids)
+        if len(sku_ids) < batch_size:
+            break
+
+    return total
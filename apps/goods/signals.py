@@ -0,0 +1,124 @@
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from goods.models import GoodsType, GoodsSKU, Goods
+from goods import static_pages
+from goods.sku_cache import invalidate_skus
+from goods.type_cache import bump_types_version
+from goods.catalog import invalidate_catalog
+from goods import rankings, suggest
+from order.stock import invalidate_counters
+from celery_tasks import tasks
+
+
+@receiver(pre_save, sender=GoodsSKU)
+def remember_sku_type(sender, instance, **kwargs):
+    '''
+    记录商品修改前所属的种类,SPU和库存,商品换了种类时,原来种类的列表页也要重新生成,
+    商品也要从原来种类的排行中删除,原来SPU的商品列表也要删除,库存被修改时要重新加载redis中的库存
+    '''
+    instance._old_type_id = None
+    instance._old_goods_id = None
+    instance._old_stock = None
+    if instance.id:
+        old = GoodsSKU.objects.filter(id=instance.id).values_list('type_id', 'goods_id', 'stock').first()
+        if old:
+            instance._old_type_id, instance._old_goods_id, instance._old_stock = old
+
+
+@receiver(post_save, sender=GoodsSKU)
+@receiver(post_delete, sender=GoodsSKU)
+def sku_changed(sender, instance, **kwargs):
+    '''商品被添加,修改或删除后,重新生成依赖这个商品的静态页面'''
+    sku_ids, type_ids = static_pages.get_dependent_pages(instance, getattr(instance, '_old_type_id', None))
+    static_pages.mark_dirty(sku_ids, type_ids)
+    tasks.schedule_static_pages()
+
+
+@receiver(post_save, sender=GoodsSKU)
+@receiver(post_delete, sender=GoodsSKU)
+def invalidate_sku_cache(sender, instance, **kwargs):
+    '''
+    商品被修改或删除后,删除缓存中的商品快照和SPU的商品列表,
+    事务提交后再删除,否则其他请求可能在提交前读到修改前的数据并重新缓存
+    '''
+    sku_id = instance.id
+    goods_ids = {instance.goods_id, getattr(instance, '_old_goods_id', None)} - {None}
+
+    def invalidate():
+        invalidate_skus([sku_id])
+        invalidate_catalog(goods_ids)
+    transaction.on_commit(invalidate)
+
+
+@receiver(post_save, sender=GoodsSKU)
+@receiver(post_delete, sender=GoodsSKU)
+def reset_stock_counter(sender, instance, **kwargs):
+    '''
+    后台修改了商品的库存或者删除了商品后,删除redis中的库存计数器(见order.stock),
+    事务提交后再删除,下次下单时从mysql中重新加载
+    '''
+    if kwargs.get('created') or instance.stock == getattr(instance, '_old_stock', None):
+        return
+    sku_id = instance.id
+    transaction.on_commit(lambda: invalidate_counters([sku_id]))
+
+
+@receiver(post_save, sender=GoodsSKU)
+def update_rankings(sender, instance, **kwargs):
+    '''商品被添加或修改后,更新种类的排行'''
+    rankings.update_sku(instance, getattr(instance, '_old_type_id', None))
+
+
+@receiver(post_delete, sender=GoodsSKU)
+def remove_from_rankings(sender, instance, **kwargs):
+    '''商品被删除后,从种类的排行中删除'''
+    rankings.remove_sku(instance.type_id, instance.id)
+
+
+@receiver(post_save, sender=GoodsSKU)
+def update_suggestions(sender, instance, **kwargs):
+    '''商品被添加或修改后,更新搜索框的输入提示,只修改了库存,销量时不需要更新'''
+    update_fields = kwargs.get('update_fields')
+    if update_fields and 'name' not in update_fields:
+        return
+    suggest.update_sku(instance)
+
+
+@receiver(post_delete, sender=GoodsSKU)
+def remove_suggestions(sender, instance, **kwargs):
+    '''商品被删除后,删除搜索框的输入提示'''
+    suggest.remove_sku(instance.id)
+
+
+@receiver(post_save, sender=Goods)
+def goods_changed(sender, instance, **kwargs):
+    '''商品SPU(如商品详情)被修改后,重新生成这个SPU下所有商品的详情页'''
+    sku_ids = list(GoodsSKU.objects.filter(goods=instance).values_list('id', flat=True))
+    goods_id = instance.id
+
+    def invalidate():
+        invalidate_skus(sku_ids) # 商品快照中包含了SPU
+        invalidate_catalog([goods_id])
+    transaction.on_commit(invalidate)
+    static_pages.mark_dirty(sku_ids)
+    tasks.schedule_static_pages()
+
+
+@receiver(post_save, sender=GoodsType)
+@receiver(post_delete, sender=GoodsType)
+def type_changed(sender, instance, **kwargs):
+    '''
+    所有页面上都有商品种类的导航,种类被修改后重新生成所有页面,
+    事务提交后所有进程重新加载种类,并删除商品快照(快照中包含了种类)
+    '''
+    sku_ids = list(GoodsSKU.objects.filter(type_id=instance.id).values_list('id', flat=True))
+
+    def invalidate():
+        bump_types_version()
+        invalidate_skus(sku_ids)
+    transaction.on_commit(invalidate)
+    static_pages.mark_all_dirty()
+    static_pages.mark_dirty(type_ids=[instance.id])
+    tasks.schedule_static_pages()
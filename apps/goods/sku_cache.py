@@ -0,0 +1,132 @@
+'''
+商品sku快照的两级缓存:
+    1.进程内的LRU缓存,有很短的过期时间,热门商品的读取不需要访问redis
+    2.redis缓存(django的缓存),所有进程共用
+
+商品被修改或删除后(goods.signals),删除redis中的快照和本进程中的快照,
+其他进程中的快照最多在SKU_LOCAL_CACHE_TTL秒后过期
+
+快照中同时加载了商品的SPU(goods)和种类(type),SPU或者种类被修改后也要删除快照,
+SPU的商品详情(富文本)不在快照中,详情页单独从缓存中获取(见goods.catalog.get_goods_detail)
+'''
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+from goods.models import GoodsSKU
+
+# 商品sku快照在缓存中的key格式和过期时间
+SKU_CACHE_KEY = 'goods_sku_%d'
+SKU_CACHE_TIMEOUT = 600
+
+
+class LocalCache(object):
+    '''
+    进程内的LRU缓存,超过max_size时淘汰最久没有使用的数据,数据超过ttl秒后过期
+    '''
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict() # {key: (过期时间, value)}
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        now = time.time()
+        result = {}
+        with self._lock:
+            for key in keys:
+                item = self._data.get(key)
+                if item is None:
+                    continue
+                if item[0] <= now:
+                    del self._data[key]
+                    continue
+                self._data.move_to_end(key)
+                result[key] = item[1]
+        return result
+
+    def set_many(self, data):
+        expires = time.time() + self.ttl
+        with self._lock:
+            for key, value in data.items():
+                self._data[key] = (expires, value)
+                self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+local_cache = LocalCache(settings.SKU_LOCAL_CACHE_SIZE, settings.SKU_LOCAL_CACHE_TTL)
+
+
+def _copy_sku(sku):
+    '''
+    返回商品对象的副本,调用者给商品添加的属性(如购物车中的count,amount)
+    和加载的关联对象不会影响缓存中的对象
+    '''
+    sku_copy = copy.copy(sku)
+    sku_copy._state = copy.copy(sku._state)
+    if hasattr(sku._state, 'fields_cache'):
+        sku_copy._state.fields_cache = dict(sku._state.fields_cache)
+    return sku_copy
+
+
+def get_skus(sku_ids):
+    '''
+    批量获取商品sku对象,依次从进程内缓存,redis缓存中一次取出所有的商品,
+    缓存中都没有的商品,再用一条id__in查询从数据库中获取并写回两级缓存
+    :param sku_ids: 商品id的列表,元素可以是int,str或者redis返回的bytes
+    :return: {商品id(int): 商品sku对象},不存在的商品不会出现在字典中
+    '''
+    sku_ids = [int(sku_id) for sku_id in sku_ids]
+    if not sku_ids:
+        return {}
+
+    keys = {SKU_CACHE_KEY % sku_id: sku_id for sku_id in sku_ids}
+    skus = {keys[key]: sku for key, sku in local_cache.get_many(keys).items()}
+
+    # 进程内缓存中没有的商品,一次从redis中取出来
+    missing_keys = [SKU_CACHE_KEY % sku_id for sku_id in set(sku_ids) if sku_id not in skus]
+    if missing_keys:
+        cached = cache.get_many(missing_keys)
+        local_cache.set_many(cached)
+        skus.update((keys[key], sku) for key, sku in cached.items())
+
+    # redis中也没有的商品,一次性从数据库中查出来
+    missing_ids = [sku_id for sku_id in set(sku_ids) if sku_id not in skus]
+    if missing_ids:
+        loaded = GoodsSKU.objects.select_related('goods', 'type').defer('goods__detail').in_bulk(missing_ids)
+        loaded = {SKU_CACHE_KEY % sku_id: sku for sku_id, sku in loaded.items()}
+        cache.set_many(loaded, SKU_CACHE_TIMEOUT)
+        local_cache.set_many(loaded)
+        skus.update((keys[key], sku) for key, sku in loaded.items())
+
+    return {sku_id: _copy_sku(sku) for sku_id, sku in skus.items()}
+
+
+def get_sku(sku_id):
+    '''
+    获取单个商品sku对象,商品不存在时返回None
+    '''
+    return get_skus([sku_id]).get(int(sku_id))
+
+
+def invalidate_skus(sku_ids):
+    '''
+    商品信息(如库存)被修改后,删除两级缓存中的商品快照
+    '''
+    keys = [SKU_CACHE_KEY % int(sku_id) for sku_id in sku_ids]
+    local_cache.delete_many(keys)
+    cache.delete_many(keys)
@@ -0,0 +1,160 @@
+'''
+生成商品详情页和列表页的静态页面,给没有登录的用户使用,由nginx直接返回,例如:
+
+    location ~ ^/goods/(\d+)$ {
+        set $static "";
+        if ($cookie_sessionid = "") { set $static "1"; }
+        if ($arg_comment_page != "") { set $static ""; }  # 评论的其他页由django返回
+        if ($static = "1") { rewrite ^ /static/detail/$1.html last; }
+        proxy_pass http://django;
+    }
+    location ~ ^/list/(?<type_id>\d+)/(?<page>\d+)$ {
+        set $static "";
+        if ($cookie_sessionid = "") { set $static "${arg_sort}_${arg_dir}"; }
+        if ($static = "_") { set $static "default_asc"; }
+        if ($static ~ ^(default|price)_(asc|desc)$) { rewrite ^ /static/list/$type_id/$static/$page.html last; }
+        proxy_pass http://django;
+    }
+
+商品被修改后,只重新生成依赖这个商品的页面,见get_dependent_pages
+'''
+import glob
+import os
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.template import loader
+from django_redis import get_redis_connection
+
+from goods.catalog import get_detail_data, get_list_data, NEW_SKUS_COUNT, LIST_ORDERINGS
+from goods.models import GoodsType, GoodsSKU
+from utils.static_files import write_static_file, remove_static_file
+
+# 静态页面的路径
+DETAIL_PAGE_PATH = 'static/detail/%d.html'
+LIST_PAGE_DIR = 'static/list/%d'
+LIST_PAGE_PATH = 'static/list/%d/%s_%s/%d.html'
+
+# 静态列表页的排序方式和排序方向,
+# 按销量和近期销量排序的页面随着下单变化,不生成静态页面,由django返回(nginx配置中也不包括)
+LIST_SORTS = [(sort, direction) for sort in LIST_ORDERINGS if sort not in ('hot', 'recent')
+              for direction in ('asc', 'desc')]
+
+# 等待重新生成的详情页(商品id)和列表页(种类id)
+DIRTY_SKUS_KEY = 'static_pages_dirty_skus'
+DIRTY_TYPES_KEY = 'static_pages_dirty_types'
+
+
+def _path(relative_path):
+    return os.path.join(settings.BASE_DIR, relative_path)
+
+
+def generate_detail_page(sku_id):
+    '''
+    生成某个商品的静态详情页,商品已经被删除时删除静态页面
+    '''
+    path = _path(DETAIL_PAGE_PATH % sku_id)
+    sku = GoodsSKU.objects.select_related('type', 'goods').filter(id=sku_id).first()
+    if sku is None:
+        remove_static_file(path)
+        return False
+
+    context = get_detail_data(sku)
+    context.update(cart_count=0)
+    html = loader.render_to_string('detail.html', context)
+    return write_static_file(path, html, settings.STATIC_PRECOMPRESS)
+
+
+def generate_list_pages(type_id):
+    '''
+    生成某个种类在所有排序方式下的所有静态列表页,并删除多余的页面
+    :return: 重新写入的页面数
+    '''
+    ctype = GoodsType.objects.filter(id=type_id).first()
+    if ctype is None:
+        for path in glob.glob(_path(LIST_PAGE_DIR % type_id) + '/*/*.html'):
+            remove_static_file(path)
+        return 0
+
+    count = GoodsSKU.objects.filter(type=ctype).count()
+    num_pages = Paginator(range(count), settings.GOODS_LIST_PAGE_SIZE).num_pages
+
+    written = 0
+    for sort, direction in LIST_SORTS:
+        for page in range(1, num_pages + 1):
+            context = get_list_data(ctype, sort, direction, page)
+            context.update(cart_count=0)
+            html = loader.render_to_string('list.html', context)
+            if write_static_file(_path(LIST_PAGE_PATH % (type_id, sort, direction, page)), html, settings.STATIC_PRECOMPRESS):
+                written += 1
+
+        # 商品减少后,删除多余的页面
+        for path in glob.glob(_path(LIST_PAGE_DIR % type_id) + '/%s_%s/*.html' % (sort, direction)):
+            if int(os.path.basename(path)[:-len('.html')]) > num_pages:
+                remove_static_file(path)
+
+    return written
+
+
+def get_dependent_pages(sku, old_type_id=None):
+    '''
+    商品被添加,修改或删除后,需要重新生成的页面:
+        1.商品自己的详情页
+        2.同一个SPU的其他规格商品的详情页(展示了其他规格的名称)
+        3.商品是新品时,同种类所有商品的详情页(展示了新品)
+        4.商品所属种类(以及修改前所属种类)的所有列表页
+    详情页中新品的数量为NEW_SKUS_COUNT,这些商品修改后,同种类的所有详情页都要重新生成
+    :return: (商品id的集合, 种类id的集合)
+    '''
+    sku_ids = {sku.id}
+    sku_ids.update(GoodsSKU.objects.filter(goods_id=sku.goods_id).values_list('id', flat=True))
+
+    type_ids = {sku.type_id}
+    if old_type_id is not None:
+        type_ids.add(old_type_id)
+
+    for type_id in type_ids:
+        # 商品的创建时间不早于种类中第NEW_SKUS_COUNT新的商品时,商品是(或者曾经是)新品
+        new_times = list(GoodsSKU.objects.filter(type_id=type_id).order_by('-create_time')
+                         .values_list('create_time', flat=True)[:NEW_SKUS_COUNT])
+        if len(new_times) < NEW_SKUS_COUNT or sku.create_time >= new_times[-1]:
+            sku_ids.update(GoodsSKU.objects.filter(type_id=type_id).values_list('id', flat=True))
+
+    return sku_ids, type_ids
+
+
+def mark_dirty(sku_ids=(), type_ids=()):
+    '''记录需要重新生成的页面,由celery任务统一生成'''
+    conn = get_redis_connection('default')
+    pipe = conn.pipeline()
+    if sku_ids:
+        pipe.sadd(DIRTY_SKUS_KEY, *sku_ids)
+    if type_ids:
+        pipe.sadd(DIRTY_TYPES_KEY, *type_ids)
+    pipe.execute()
+
+
+def mark_all_dirty():
+    '''所有页面都需要重新生成,如商品种类被修改时'''
+    mark_dirty(list(GoodsSKU.objects.values_list('id', flat=True)), list(GoodsType.objects.values_list('id', flat=True)))
+
+
+def generate_dirty_pages():
+    '''
+    取出所有需要重新生成的页面,并重新生成
+    :return: 重新写入的页面数
+    '''
+    conn = get_redis_connection('default')
+    pipe = conn.pipeline()
+    pipe.smembers(DIRTY_SKUS_KEY)
+    pipe.smembers(DIRTY_TYPES_KEY)
+    pipe.delete(DIRTY_SKUS_KEY, DIRTY_TYPES_KEY)
+    sku_ids, type_ids, _ = pipe.execute()
+
+    written = 0
+    for sku_id in sorted(int(sku_id) for sku_id in sku_ids):
+        if generate_detail_page(sku_id):
+            written += 1
+    for type_id in sorted(int(type_id) for type_id in type_ids):
+        written += generate_list_pages(type_id)
+    return written
@@ -0,0 +1,177 @@
+'''
+搜索框的输入提示,根据输入的前缀返回匹配的商品名称
+
+所有的提示词保存在redis的一个有序集合中,分数都是0,用ZRANGEBYLEX按前缀查找,
+成员的格式为: 提示词\x00商品名称\x00商品id,一次查询就可以得到商品名称,不需要再获取商品
+
+每个商品的提示词:
+    1.规范化后的商品名称,以及从名称中每个词开始的后缀,如"新鲜草莓"和"草莓"
+    2.名称的全拼和拼音首字母,如"xinxiancaomei"和"xxcm",需要安装pypinyin(见README.md)
+
+商品被添加,修改或删除时由goods.signals增量更新,python manage.py rebuild_suggest 重建
+'''
+import logging
+
+from django.conf import settings
+from django_redis import get_redis_connection
+
+from goods.models import GoodsSKU
+from goods.search import normalize_query
+from utils.analyzer import tokenize
+
+logger = logging.getLogger(__name__)
+
+try:
+    from pypinyin import lazy_pinyin, Style
+except ImportError: # 没有安装pypinyin时不支持拼音提示
+    lazy_pinyin = None
+    logger.warning('没有安装pypinyin,搜索框的输入提示不支持拼音和拼音首字母: pip install pypinyin')
+
+# 所有的提示词
+SUGGEST_KEY = 'suggest_index'
+# 每个商品的提示词成员,删除或修改商品时使用 {商品id: 成员1\x01成员2...}
+SUGGEST_MEMBERS_KEY = 'suggest_members'
+# 重建时先写入临时的key,完成后再替换正式的key,重建过程中查询不受影响
+SUGGEST_TMP_KEY = 'suggest_index_tmp'
+SUGGEST_MEMBERS_TMP_KEY = 'suggest_members_tmp'
+# 正在重建的标记,以及重建过程中被修改的商品id,替换正式的key之后重新更新这些商品
+SUGGEST_REBUILDING_KEY = 'suggest_rebuilding'
+SUGGEST_CHANGED_KEY = 'suggest_changed'
+SUGGEST_REBUILD_TIMEOUT = 3600
+
+# 用新的提示词成员替换商品原来的提示词成员,读取和修改在一个脚本中原子地完成,
+# 同一个商品同时被修改两次时,不会留下没有被删除的提示词
+# KEYS: SUGGEST_KEY, SUGGEST_MEMBERS_KEY, SUGGEST_REBUILDING_KEY, SUGGEST_CHANGED_KEY
+# ARGV[1]: 商品id, ARGV[2]: 用\x01连接的新成员,为空字符串时删除商品的提示词
+UPDATE_SCRIPT = r'''
+local old = redis.call('hget', KEYS[2], ARGV[1])
+if old then
+    for member in string.gmatch(old, '[^\1]+') do
+        redis.call('zrem', KEYS[1], member)
+    end
+end
+if ARGV[2] == '' then
+    redis.call('hdel', KEYS[2], ARGV[1])
+else
+    for member in string.gmatch(ARGV[2], '[^\1]+') do
+        redis.call('zadd', KEYS[1], 0, member)
+    end
+    redis.call('hset', KEYS[2], ARGV[1], ARGV[2])
+end
+if redis.call('exists', KEYS[3]) == 1 then
+    redis.call('sadd', KEYS[4], ARGV[1])
+end
+return 0
+'''
+
+
+def _terms(name):
+    '''商品名称对应的所有提示词'''
+    name = normalize_query(name)
+    if not name:
+        return set()
+
+    terms = {name}
+    for word, start, end in tokenize(name):
+        terms.add(name[start:])
+
+    if lazy_pinyin is not None:
+        terms.add(''.join(lazy_pinyin(name)))
+        terms.add(''.join(lazy_pinyin(name, style=Style.FIRST_LETTER)))
+    terms.discard('')
+    return terms
+
+
+def _members(sku):
+    return {'%s\x00%s\x00%d' % (term, sku.name, sku.id) for term in _terms(sku.name)}
+
+
+def _update(sku_id, members):
+    conn = get_redis_connection('default')
+    conn.register_script(UPDATE_SCRIPT)(
+        keys=[SUGGEST_KEY, SUGGEST_MEMBERS_KEY, SUGGEST_REBUILDING_KEY, SUGGEST_CHANGED_KEY],
+        args=[sku_id, '\x01'.join(members)])
+
+
+def update_sku(sku):
+    '''商品被添加或修改后,更新商品的提示词'''
+    _update(sku.id, _members(sku))
+
+
+def remove_sku(sku_id):
+    '''商品被删除后,删除商品的提示词'''
+    _update(sku_id, ())
+
+
+def rebuild(chunk_size=1000):
+    '''
+    从mysql中重建所有商品的提示词,写入临时的key,完成后用RENAME替换正式的key,
+    重建过程中被修改的商品,替换后再更新一次
+    :return: 商品数
+    '''
+    conn = get_redis_connection('default')
+    pipe = conn.pipeline()
+    pipe.delete(SUGGEST_TMP_KEY, SUGGEST_MEMBERS_TMP_KEY, SUGGEST_CHANGED_KEY)
+    pipe.set(SUGGEST_REBUILDING_KEY, 1, ex=SUGGEST_REBUILD_TIMEOUT)
+    pipe.execute()
+
+    count = 0
+    has_members = False
+    pipe = conn.pipeline(transaction=False)
+    for sku in GoodsSKU.objects.only('id', 'name').order_by('id').iterator():
+        members = _members(sku)
+        if members:
+            pipe.zadd(SUGGEST_TMP_KEY, {member: 0 for member in members})
+            pipe.hset(SUGGEST_MEMBERS_TMP_KEY, sku.id, '\x01'.join(members))
+            has_members = True
+        count += 1
+        if count % chunk_size == 0:
+            pipe.execute()
+    pipe.execute()
+
+    # 在一个事务中替换正式的key,没有任何提示词时临时的key不存在,直接删除正式的key
+    pipe = conn.pipeline()
+    if has_members:
+        pipe.rename(SUGGEST_TMP_KEY, SUGGEST_KEY)
+        pipe.rename(SUGGEST_MEMBERS_TMP_KEY, SUGGEST_MEMBERS_KEY)
+    else:
+        pipe.delete(SUGGEST_KEY, SUGGEST_MEMBERS_KEY)
+    pipe.delete(SUGGEST_REBUILDING_KEY)
+    pipe.smembers(SUGGEST_CHANGED_KEY)
+    pipe.delete(SUGGEST_CHANGED_KEY)
+    changed = [int(sku_id) for sku_id in pipe.execute()[-2]]
+
+    skus = GoodsSKU.objects.only('id', 'name').in_bulk(changed)
+    for sku_id in changed:
+        if sku_id in skus:
+            update_sku(skus[sku_id])
+        else:
+            remove_sku(sku_id)
+    return count
+
+
+def suggest(prefix, limit=None):
+    '''
+    获取以prefix开头的提示词对应的商品
+    :return: [{'id': 商品id, 'name': 商品名称}, ...],同一个商品只出现一次
+    '''
+    limit = limit or settings.SUGGEST_LIMIT
+    prefix = normalize_query(prefix).encode('utf-8')
+    if not prefix:
+        return []
+
+    # 一个商品可能有多个提示词匹配前缀,多取一些再去重
+    members = get_redis_connection('default').zrangebylex(
+        SUGGEST_KEY, b'[' + prefix, b'[' + prefix + b'\xff', start=0, num=limit * 4)
+
+    result = []
+    seen = set()
+    for member in members:
+        term, name, sku_id = member.decode().split('\x00')
+        if sku_id in seen:
+            continue
+        seen.add(sku_id)
+        result.append({'id': int(sku_id), 'name': name})
+        if len(result) >= limit:
+            break
+    return result
@@ -1,3 +1,205 @@
-from django.test import TestCase
+import gzip
+import os
+import shutil
+import tempfile
+from unittest import mock, skipIf
 
-# Create your tests here.
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from goods import suggest
+from goods.models import GoodsSKU
+from goods.sku_cache import LocalCache
+from goods.search import normalize_query, search_ids, get_stats
+from utils.static_files import write_static_file, remove_static_file
+from utils.single_flight import FRESH_KEY, LOCK_KEY, get_or_rebuild, mark_stale
+from utils.testing import RedisTestCase
+
+
+class SingleFlightTest(RedisTestCase):
+    '''防止缓存击穿和过期后返回旧数据的缓存读取'''
+    key = 'test_single_flight'
+
+    def setUp(self):
+        super().setUp()
+        self.rebuild = mock.Mock(side_effect=['v1', 'v2', 'v3'])
+
+    def test_fresh(self):
+        self.assertEqual(get_or_rebuild(self.key, self.rebuild, 60), 'v1')
+        self.assertEqual(get_or_rebuild(self.key, self.rebuild, 60), 'v1')
+        self.assertEqual(self.rebuild.call_count, 1)
+
+    def test_stale(self):
+        get_or_rebuild(self.key, self.rebuild, 60)
+        mark_stale(self.key)
+        self.assertEqual(cache.get(self.key), 'v1')
+
+        # 其他请求正在重新生成数据时,返回陈旧数据
+        lock = self.conn.lock(LOCK_KEY % self.key, timeout=30)
+        lock.acquire()
+        self.assertEqual(get_or_rebuild(self.key, self.rebuild, 60), 'v1')
+        self.assertEqual(self.rebuild.call_count, 1)
+        lock.release()
+
+        # 拿到锁的请求重新生成数据
+        self.assertEqual(get_or_rebuild(self.key, self.rebuild, 60), 'v2')
+        self.assertEqual(cache.get(FRESH_KEY % self.key), 1)
+
+    def test_wait_timeout(self):
+        # 没有缓存数据,其他请求一直没有生成数据时,等待超时后自己生成,但不写入缓存
+        self.conn.lock(LOCK_KEY % self.key, timeout=30).acquire()
+        self.assertEqual(get_or_rebuild(self.key, self.rebuild, 60, wait=0.1), 'v1')
+        self.assertIsNone(cache.get(self.key))
+
+    def test_lock_expired(self):
+        # 重新生成数据的时间超过了锁的过期时间,释放锁时不报错
+        def rebuild():
+            self.conn.delete(LOCK_KEY % self.key)
+            return 'v1'
+
+        self.assertEqual(get_or_rebuild(self.key, rebuild, 60), 'v1')
+        self.assertEqual(cache.get(self.key), 'v1')
+
+
+class StaticFileTest(TestCase):
+    '''生成静态页面文件和预压缩文件'''
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.path = os.path.join(self.dirname, 'list', 'index.html')
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def test_write(self):
+        self.assertTrue(write_static_file(self.path, '<p>天天生鲜</p>'))
+        with open(self.path, encoding='utf-8') as f:
+            self.assertEqual(f.read(), '<p>天天生鲜</p>')
+        with open(self.path + '.gz', 'rb') as f:
+            self.assertEqual(gzip.decompress(f.read()).decode('utf-8'), '<p>天天生鲜</p>')
+        # 写入时使用的临时文件都被重命名了
+        self.assertFalse([name for name in os.listdir(os.path.dirname(self.path)) if name.startswith('.tmp_')])
+
+    def test_unchanged(self):
+        # 内容没有变化时不重新写入
+        write_static_file(self.path, 'v1')
+        self.assertFalse(write_static_file(self.path, 'v1'))
+        self.assertTrue(write_static_file(self.path, 'v2'))
+
+    def test_without_precompress(self):
+        write_static_file(self.path, 'v1', precompress=False)
+        self.assertTrue(os.path.exists(self.path))
+        self.assertFalse(os.path.exists(self.path + '.gz'))
+
+    def test_remove(self):
+        write_static_file(self.path, 'v1')
+        remove_static_file(self.path)
+        self.assertEqual(os.listdir(os.path.dirname(self.path)), [])
+        # 文件不存在时不报错
+        remove_static_file(self.path)
+
+
+class LocalCacheTest(TestCase):
+    '''进程内的LRU缓存'''
+    def test_lru(self):
+        local_cache = LocalCache(2, 60)
+        local_cache.set_many({'a': 1, 'b': 2})
+        # 读取a后b变为最久没有使用的数据,超过max_size时被淘汰
+        self.assertEqual(local_cache.get_many(['a']), {'a': 1})
+        local_cache.set_many({'c': 3})
+        self.assertEqual(local_cache.get_many(['a', 'b', 'c']), {'a': 1, 'c': 3})
+
+    def test_ttl(self):
+        local_cache = LocalCache(10, 60)
+        with mock.patch('goods.sku_cache.time.time', return_value=1000):
+            local_cache.set_many({'a': 1})
+        with mock.patch('goods.sku_cache.time.time', return_value=1059):
+            self.assertEqual(local_cache.get_many(['a']), {'a': 1})
+        with mock.patch('goods.sku_cache.time.time', return_value=1060):
+            self.assertEqual(local_cache.get_many(['a']), {})
+        self.assertEqual(len(local_cache._data), 0)
+
+    def test_delete(self):
+        local_cache = LocalCache(10, 60)
+        local_cache.set_many({'a': 1, 'b': 2, 'c': 3})
+        local_cache.delete_many(['a', 'x'])
+        self.assertEqual(local_cache.get_many(['a', 'b']), {'b': 2})
+        local_cache.clear()
+        self.assertEqual(local_cache.get_many(['b', 'c']), {})
+
+
+class SearchTest(RedisTestCase):
+    '''搜索结果的缓存和查询词的统计'''
+    def test_normalize_query(self):
+        # 全角转半角,大写转小写,合并空白
+        self.assertEqual(normalize_query(' Ｓｔｒａｗｂｅｒｒｙ\u3000 草莓\n'), 'strawberry 草莓')
+        self.assertEqual(normalize_query('草莓'), normalize_query('草莓 '))
+        self.assertEqual(normalize_query(None), '')
+
+    @mock.patch('goods.search.SearchQuerySet')
+    def test_search_ids_cached(self, search_query_set):
+        results = [mock.Mock(pk='3'), mock.Mock(pk='1')]
+        search_query_set.return_value.models.return_value.auto_query.return_value = results
+        self.assertEqual(search_ids('草莓'), [3, 1])
+        self.assertEqual(search_ids('草莓'), [3, 1])
+        self.assertEqual(search_query_set.call_count, 1)
+
+        stats = get_stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['hit_ratio']), (1, 1, 0.5))
+        self.assertEqual(stats['top_queries'], [('草莓', 2)])
+
+    @override_settings(SEARCH_QUERIES_KEEP=2, SEARCH_QUERY_MAX_LENGTH=4)
+    @mock.patch('goods.search.SearchQuerySet')
+    def test_query_counts_bounded(self, search_query_set):
+        search_query_set.return_value.models.return_value.auto_query.return_value = []
+        # 只记录查询词的前面部分
+        search_ids('abcdefg')
+        self.assertEqual(get_stats()['top_queries'], [('abcd', 1)])
+
+        # 查询词的个数超过SEARCH_QUERIES_KEEP的两倍时,只保留次数最多的几个
+        for query in ('a', 'a', 'b', 'c', 'd'):
+            search_ids(query)
+        top_queries = get_stats()['top_queries']
+        self.assertEqual(len(top_queries), 2)
+        self.assertEqual(top_queries[0], ('a', 2))
+
+
+class SuggestTest(RedisTestCase):
+    '''搜索框的输入提示'''
+    def test_terms(self):
+        # 规范化后的名称,以及从名称中每个词开始的后缀
+        terms = suggest._terms('新鲜草莓 ５００ｇ')
+        self.assertIn('新鲜草莓 500g', terms)
+        self.assertIn('草莓 500g', terms)
+        self.assertNotIn('', terms)
+        self.assertEqual(suggest._terms('  '), set())
+
+    @skipIf(suggest.lazy_pinyin is None, '没有安装pypinyin')
+    def test_pinyin_terms(self):
+        terms = suggest._terms('草莓')
+        self.assertIn('caomei', terms)
+        self.assertIn('cm', terms)
+
+    def test_update_and_remove(self):
+        sku = GoodsSKU(id=1, name='新鲜草莓')
+        suggest.update_sku(sku)
+        suggest.update_sku(GoodsSKU(id=2, name='草莓干'))
+        # 按提示词的字典序返回,同一个商品有多个提示词匹配时只出现一次
+        self.assertEqual(suggest.suggest('草莓'), [{'id': 1, 'name': '新鲜草莓'}, {'id': 2, 'name': '草莓干'}])
+        self.assertEqual(suggest.suggest('草莓', limit=1), [{'id': 1, 'name': '新鲜草莓'}])
+        self.assertEqual(suggest.suggest('新鲜'), [{'id': 1, 'name': '新鲜草莓'}])
+
+        # 修改名称后删除原来的提示词
+        sku.name = '冬枣'
+        suggest.update_sku(sku)
+        self.assertEqual(suggest.suggest('新鲜'), [])
+        self.assertEqual(suggest.suggest('冬枣'), [{'id': 1, 'name': '冬枣'}])
+
+        suggest.remove_sku(1)
+        self.assertEqual(suggest.suggest('冬枣'), [])
+        self.assertFalse(self.conn.hexists(suggest.SUGGEST_MEMBERS_KEY, 1))
+
+    def test_changed_while_rebuilding(self):
+        # 重建过程中被修改的商品被记录下来,替换正式的key之后再更新一次
+        self.conn.set(suggest.SUGGEST_REBUILDING_KEY, 1)
+        suggest.update_sku(GoodsSKU(id=1, name='草莓'))
+        self.assertEqual(self.conn.smembers(suggest.SUGGEST_CHANGED_KEY), {b'1'})
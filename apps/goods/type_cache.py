@@ -0,0 +1,53 @@
+'''
+商品种类的进程内缓存,种类只在后台被修改,几乎每个页面都要展示种类的导航
+
+redis中保存种类的版本号,修改种类的事务提交后版本号加1(见goods.signals),
+每个进程只在版本号变化时重新从数据库中加载种类
+'''
+import threading
+
+from django_redis import get_redis_connection
+
+from goods.models import GoodsType
+
+# 商品种类的版本号
+TYPES_VERSION_KEY = 'goods_types_version'
+
+_lock = threading.Lock()
+_version = None
+_types = []
+
+
+def get_types():
+    '''
+    获取所有商品种类,每次只需要从redis中读取版本号
+    :return: 商品种类对象的列表,调用者不能修改其中的对象
+    '''
+    global _version, _types
+    conn = get_redis_connection('default')
+    version = conn.get(TYPES_VERSION_KEY)
+    if version is None: # 还没有版本号时,设置初始的版本号
+        conn.set(TYPES_VERSION_KEY, 1, nx=True)
+        version = conn.get(TYPES_VERSION_KEY)
+    if version == _version:
+        return _types
+
+    with _lock:
+        if version != _version:
+            _types = list(GoodsType.objects.all())
+            _version = version
+        return _types
+
+
+def get_type(type_id):
+    '''获取某个商品种类,种类不存在时返回None'''
+    type_id = int(type_id)
+    for ctype in get_types():
+        if ctype.id == type_id:
+            return ctype
+    return None
+
+
+def bump_types_version():
+    '''商品种类被修改后调用,所有进程下一次获取种类时重新加载'''
+    get_redis_connection('default').incr(TYPES_VERSION_KEY)
@@ -1,8 +1,11 @@
 from django.conf.urls import url,include
-from goods.views import IndexView,DetailView,ListView
+from goods.views import IndexView,DetailView,ListView,SearchView,SearchStatsView,SuggestView
 
 urlpatterns = [
     url(r'^index$', IndexView.as_view(), name='index'), # 首页
     url(r'^goods/(?P<goods_id>\d+)$', DetailView.as_view(), name='detail'), # 商品详情
     url(r'^list/(?P<type_id>\d+)/(?P<page>\d+)$',ListView.as_view(),name='list'), # 列表页
+    url(r'^search/?$', SearchView.as_view(), name='search'), # 商品搜索
+    url(r'^search/stats$', SearchStatsView.as_view(), name='search_stats'), # 搜索缓存的统计信息
+    url(r'^suggest$', SuggestView.as_view(), name='suggest'), # 搜索框的输入提示
 ]
@@ -0,0 +1,141 @@
+import json
+import logging
+import time
+
+from django.conf import settings
+from django_redis import get_redis_connection
+
+from order.models import OrderInfo
+from order.payment import get_alipay
+
+logger = logging.getLogger(__name__)
+
+# 等待查询支付结果的订单 有序集合{订单id: 下一次查询的时间戳}
+PAY_PENDING_KEY = 'pay_pending'
+# 每个订单已经查询的次数 {订单id: 次数}
+PAY_ATTEMPTS_KEY = 'pay_attempts'
+# 支付失败的订单的查询结果
+PAY_FAILED_KEY = 'pay_failed_%s'
+# 一批订单被某个worker取出后,多少秒内其他worker不会再取出,
+# 查询完成后会重新设置下一次查询的时间,worker崩溃时这段时间后重新查询
+PAY_CLAIM_TIMEOUT = 60
+
+# 取出一批已经到了查询时间的订单,同时把这些订单的查询时间推迟PAY_CLAIM_TIMEOUT秒,
+# 上一批还没有查询完时celery又执行了一次,也不会重复查询同一个订单
+# KEYS[1]: PAY_PENDING_KEY, ARGV[1]: 当前时间戳, ARGV[2]: 最多取出的订单数, ARGV[3]: 推迟到的时间戳
+CLAIM_SCRIPT = '''
+local order_ids = redis.call('zrangebyscore', KEYS[1], 0, ARGV[1], 'limit', 0, ARGV[2])
+for i, order_id in ipairs(order_ids) do
+    redis.call('zadd', KEYS[1], ARGV[3], order_id)
+end
+return order_ids
+'''
+
+
+def watch_payment(order_id, restart=False):
+    '''
+    把订单加入到后台查询支付结果的队列中
+    :param restart: 用户重新发起支付时为True,清除上一次的查询结果,重新开始查询,
+                    否则已经在队列中的订单不会改变下一次查询的时间
+    '''
+    conn = get_redis_connection('default')
+    check_time = time.time() + settings.PAY_CHECK_BASE_DELAY
+    if restart:
+        pipe = conn.pipeline()
+        pipe.delete(PAY_FAILED_KEY % order_id)
+        pipe.hdel(PAY_ATTEMPTS_KEY, order_id)
+        pipe.zadd(PAY_PENDING_KEY, {order_id: check_time})
+        pipe.execute()
+    else:
+        conn.zadd(PAY_PENDING_KEY, {order_id: check_time}, nx=True)
+
+
+def get_pay_failure(order_id):
+    '''
+    获取订单支付失败时支付宝返回的结果,没有失败时返回None
+    '''
+    conn = get_redis_connection('default')
+    failure = conn.get(PAY_FAILED_KEY % order_id)
+    return json.loads(failure.decode()) if failure else None
+
+
+def get_retry_after(order_id):
+    '''
+    浏览器多少秒后再查询支付结果,即后台下一次查询这个订单的时间,最少1秒
+    '''
+    conn = get_redis_connection('default')
+    check_time = conn.zscore(PAY_PENDING_KEY, order_id)
+    if check_time is None:
+        return settings.PAY_CHECK_BASE_DELAY
+    # 多等一个查询周期,后台查询完成后浏览器再查询
+    return max(int(check_time - time.time()), 0) + settings.PAY_CHECK_INTERVAL
+
+
+def _finish(conn, order_id):
+    '''订单已经查询出结果,从队列中删除'''
+    pipe = conn.pipeline()
+    pipe.zrem(PAY_PENDING_KEY, order_id)
+    pipe.hdel(PAY_ATTEMPTS_KEY, order_id)
+    pipe.execute()
+
+
+def _backoff(conn, order_id):
+    '''订单还没有支付,按照指数退避的方式推迟下一次查询,查询次数过多时放弃查询'''
+    attempts = conn.hincrby(PAY_ATTEMPTS_KEY, order_id, 1)
+    if attempts >= settings.PAY_CHECK_MAX_ATTEMPTS:
+        conn.zrem(PAY_PENDING_KEY, order_id)
+        conn.hdel(PAY_ATTEMPTS_KEY, order_id)
+        return
+    delay = min(settings.PAY_CHECK_BASE_DELAY * 2 ** attempts, settings.PAY_CHECK_MAX_DELAY)
+    conn.zadd(PAY_PENDING_KEY, {order_id: time.time() + delay})
+
+
+def _check_payment(conn, alipay, order_id):
+    '''查询一个订单的支付结果,并根据结果更新订单'''
+    response = alipay.api_alipay_trade_query(order_id)
+    code = response.get('code')
+    trade_status = response.get('trade_status')
+    if code == '10000' and trade_status == 'TRADE_SUCCESS':
+        # 支付成功,订单状态变为待评价
+        OrderInfo.objects.filter(order_id=order_id, order_status=1).update(
+            trade_no=response.get('trade_no'), order_status=4)
+        _finish(conn, order_id)
+    elif code == '40004' or (code == '10000' and trade_status == 'WAIT_BUYER_PAY'):
+        # 等待买家付款,业务处理失败，可能一会就会成功
+        _backoff(conn, order_id)
+    else:
+        # 支付失败,保存支付宝返回的结果
+        conn.set(PAY_FAILED_KEY % order_id, json.dumps({'code': code, 'trade_status': trade_status}), ex=3600)
+        _finish(conn, order_id)
+
+
+def check_pending_payments():
+    '''
+    查询一批已经到了查询时间的订单的支付结果,由celery定时执行,
+    某个订单查询出错(网络错误,支付宝返回的数据不正确)时推迟这个订单的查询,不影响其他订单
+    :return: 本次查询的订单数
+    '''
+    conn = get_redis_connection('default')
+    now = time.time()
+    order_ids = conn.register_script(CLAIM_SCRIPT)(
+        keys=[PAY_PENDING_KEY], args=[now, settings.PAY_CHECK_BATCH_SIZE, now + PAY_CLAIM_TIMEOUT])
+    order_ids = [order_id.decode() for order_id in order_ids]
+    if not order_ids:
+        return 0
+
+    # 一次性获取这一批订单中还没有支付的订单
+    unpaid = set(OrderInfo.objects.filter(order_id__in=order_ids, order_status=1).values_list('order_id', flat=True))
+
+    alipay = get_alipay()
+    for order_id in order_ids:
+        if order_id not in unpaid: # 订单已经支付或者不存在
+            _finish(conn, order_id)
+            continue
+
+        try:
+            _check_payment(conn, alipay, order_id)
+        except Exception:
+            logger.exception('查询订单%s的支付结果失败', order_id)
+            _backoff(conn, order_id)
+
+    return len(order_ids)
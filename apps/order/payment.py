@@ -0,0 +1,130 @@
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class LatencyStats(object):
+    '''
+    统计本进程中某个操作的调用次数和耗时(毫秒)
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def record(self, ms):
+        with self.lock:
+            self.count += 1
+            self.total += ms
+            self.max = max(self.max, ms)
+            self.last = ms
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'count': self.count,
+                'avg_ms': self.total / self.count if self.count else 0.0,
+                'max_ms': self.max,
+                'last_ms': self.last,
+            }
+
+
+# 生成支付链接(对请求参数签名)的耗时统计
+sign_stats = LatencyStats()
+# 加载密钥,创建客户端的耗时统计
+load_stats = LatencyStats()
+
+# 本进程中缓存的支付宝客户端,以及创建客户端时密钥文件的修改时间
+_alipay = None
+_key_mtimes = None
+_key_checked_at = 0
+_alipay_lock = threading.Lock()
+
+
+def _get_key_mtimes():
+    mtimes = []
+    for path in (settings.ALIPAY_PRIVATE_KEY_PATH, settings.ALIPAY_PUBLIC_KEY_PATH):
+        try:
+            mtimes.append(os.path.getmtime(path))
+        except OSError:
+            mtimes.append(None)
+    return tuple(mtimes)
+
+
+def _create_alipay():
+    '''
+    根据settings中的配置,创建调用支付宝接口的客户端,创建时会读取并解析密钥文件
+    '''
+    client_class = import_string(settings.ALIPAY_CLIENT_CLASS)
+    return client_class(
+        appid=settings.ALIPAY_APPID,  # 应用id
+        app_notify_url=None,  # 默认回调url
+        app_private_key_path=settings.ALIPAY_PRIVATE_KEY_PATH,
+        # 支付宝的公钥，验证支付宝回传消息使用，不是你自己的公钥,
+        alipay_public_key_path=settings.ALIPAY_PUBLIC_KEY_PATH,
+        sign_type="RSA2",  # RSA 或者 RSA2
+        debug=settings.ALIPAY_DEBUG  # 默认False
+    )
+
+
+def get_alipay():
+    '''
+    获取本进程中缓存的支付宝客户端,密钥只在第一次使用时加载一次,
+    每隔ALIPAY_KEY_CHECK_INTERVAL秒检查一次密钥文件,文件被替换(密钥轮换)后重新加载
+    '''
+    global _alipay, _key_mtimes, _key_checked_at
+
+    now = time.time()
+    if _alipay is not None and now - _key_checked_at < settings.ALIPAY_KEY_CHECK_INTERVAL:
+        return _alipay
+
+    with _alipay_lock:
+        mtimes = _get_key_mtimes()
+        if _alipay is None or mtimes != _key_mtimes:
+            start = time.perf_counter()
+            _alipay = _create_alipay()
+            load_stats.record((time.perf_counter() - start) * 1000)
+            _key_mtimes = mtimes
+        _key_checked_at = now
+        return _alipay
+
+
+def reset_alipay():
+    '''丢弃缓存的客户端,下一次使用时重新加载密钥'''
+    global _alipay, _key_mtimes
+    with _alipay_lock:
+        _alipay = None
+        _key_mtimes = None
+
+
+def get_pay_url(order_id, total_pay, subject):
+    '''
+    生成电脑网站支付的页面地址,并统计签名的耗时
+    '''
+    alipay = get_alipay()
+
+    start = time.perf_counter()
+    # 电脑网站支付，需要跳转到https://openapi.alipaydev.com/gateway.do? + order_string
+    order_string = alipay.api_alipay_trade_page_pay(
+        out_trade_no=order_id, # 订单id
+        total_amount=str(total_pay), # 支付总金额
+        subject=subject,
+        return_url=None,
+        notify_url=None  # 可选, 不填则使用默认notify url
+    )
+    sign_stats.record((time.perf_counter() - start) * 1000)
+
+    return settings.ALIPAY_GATEWAY_URL + order_string
+
+
+def get_metrics():
+    '''本进程中支付宝客户端的耗时统计'''
+    return {'sign': sign_stats.snapshot(), 'load': load_stats.snapshot()}
@@ -0,0 +1,121 @@
+'''
+商品销量的实时统计,提交订单时只在redis中累加,不修改mysql中的商品行,
+累加的销量由celery定时批量同步到df_goods_sku.sales中(见flush_sales)
+
+同时按天统计每个种类中商品的销量,列表页按近期销量排序时使用(见goods.rankings.get_page):
+    sales_day_种类id_20191210     有序集合 {补零的商品id: 这一天的销量}
+'''
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, When
+from django.utils import timezone
+from django_redis import get_redis_connection
+
+from goods.models import GoodsSKU
+from goods.sku_cache import invalidate_skus
+from order.stock import TAKE_PENDING_SCRIPT
+
+# 还没有同步到mysql中的销量 {商品id: 销量}
+SALES_PENDING_KEY = 'sales_pending'
+# 正在同步到mysql中的销量,同步期间新的销量仍然记录在SALES_PENDING_KEY中
+SALES_PROCESSING_KEY = 'sales_pending_processing'
+# 同步销量时使用的锁,保证同一时间只有一个worker在同步
+SALES_FLUSH_LOCK_KEY = 'sales_flush_lock'
+
+# 按天统计的销量
+DAILY_SALES_KEY = 'sales_day_%d_%s'
+# 最近几天的销量合并后的结果,缓存一小段时间
+RECENT_SALES_KEY = 'sales_recent_%d_%d'
+RECENT_SALES_TIMEOUT = 300
+
+
+def _member(sku_id):
+    return '%010d' % int(sku_id)
+
+
+def record_sales(items):
+    '''
+    提交订单后记录商品的销量,所有命令在一个pipeline中发送
+    :param items: [(种类id, 商品id, 销量), ...]
+    '''
+    day = timezone.localtime().strftime('%Y%m%d')
+
+    pipe = get_redis_connection('default').pipeline(transaction=False)
+    for type_id, sku_id, count in items:
+        pipe.hincrby(SALES_PENDING_KEY, sku_id, count)
+
+        day_key = DAILY_SALES_KEY % (type_id, day)
+        pipe.zincrby(day_key, count, _member(sku_id))
+        pipe.expire(day_key, settings.SALES_DAILY_KEEP * 86400)
+    pipe.execute()
+
+
+def get_unflushed_sales(conn=None, sku_ids=None):
+    '''
+    还没有同步到mysql中的销量,更新或重建销量排行时要加上
+    :param sku_ids: 商品id的列表,为None时获取所有商品
+    :return: {商品id: 销量}
+    '''
+    conn = conn or get_redis_connection('default')
+    sales = {}
+    for key in (SALES_PENDING_KEY, SALES_PROCESSING_KEY):
+        if sku_ids is None:
+            counts = conn.hgetall(key).items()
+        else:
+            counts = zip(sku_ids, conn.hmget(key, sku_ids))
+        for sku_id, count in counts:
+            if count is not None:
+                sales[int(sku_id)] = sales.get(int(sku_id), 0) + int(count)
+    return sales
+
+
+def flush_sales():
+    '''
+    把redis中累加的销量用一条update语句同步到mysql中,由celery定时执行
+    注意:如果mysql提交成功后worker在删除SALES_PROCESSING_KEY之前崩溃,这批数据会被重复同步
+    :return: 同步的商品种类数
+    '''
+    conn = get_redis_connection('default')
+    lock = conn.lock(SALES_FLUSH_LOCK_KEY, timeout=60)
+    if not lock.acquire(blocking=False): # 其他worker正在同步
+        return 0
+
+    try:
+        pending = conn.register_script(TAKE_PENDING_SCRIPT)(keys=[SALES_PENDING_KEY, SALES_PROCESSING_KEY])
+        # hgetall返回的是[field1, value1, field2, value2...]
+        pending = {int(sku_id): int(count) for sku_id, count in zip(pending[::2], pending[1::2]) if int(count)}
+
+        if pending:
+            sales_case = Case(*[When(id=sku_id, then=F('sales') + count) for sku_id, count in pending.items()],
+                              output_field=IntegerField())
+            with transaction.atomic():
+                GoodsSKU.objects.filter(id__in=list(pending)).update(sales=sales_case)
+
+        conn.delete(SALES_PROCESSING_KEY)
+        invalidate_skus(pending.keys())
+    finally:
+        lock.release()
+
+    return len(pending)
+
+
+def get_recent_sales_key(type_id, days, base_key=None):
+    '''
+    合并种类中最近几天(包括今天)的按天销量,合并结果缓存RECENT_SALES_TIMEOUT秒
+    :param base_key: 同时合并的有序集合,权重为0,不影响销量,最近几天没有销量的商品也会出现在结果中
+    :return: 合并结果的key,有序集合 {补零的商品id: 最近几天的销量}
+    '''
+    conn = get_redis_connection('default')
+    key = RECENT_SALES_KEY % (type_id, days)
+    if not conn.exists(key):
+        today = timezone.localtime()
+        keys = {DAILY_SALES_KEY % (type_id, (today - timedelta(days=i)).strftime('%Y%m%d')): 1 for i in range(days)}
+        if base_key:
+            keys[base_key] = 0
+        pipe = conn.pipeline()
+        pipe.zunionstore(key, keys)
+        pipe.expire(key, RECENT_SALES_TIMEOUT)
+        pipe.execute()
+    return key
@@ -0,0 +1,228 @@
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Q, When
+from django_redis import get_redis_connection
+
+from goods.models import GoodsSKU
+from goods.sku_cache import invalidate_skus
+
+# redis中商品实时库存的key,STOCK_COUNTER_TIMEOUT秒后过期,过期后从mysql中重新加载
+STOCK_KEY = 'stock_%d'
+# 已经在redis中扣减,还没有同步到mysql中的商品数量 {商品id: 数量}
+PENDING_KEY = 'stock_pending'
+# 正在同步到mysql中的商品数量,同步期间新的扣减仍然记录在PENDING_KEY中
+PROCESSING_KEY = 'stock_pending_processing'
+# 同步库存时使用的锁,保证同一时间只有一个worker在同步
+RECONCILE_LOCK_KEY = 'stock_reconcile_lock'
+# 库存计数器的版本号,每次同步库存完成或者删除计数器时加1,
+# 加载计数器期间版本号变化时,读到的数据可能不一致,重新加载
+STOCK_GEN_KEY = 'stock_counter_gen'
+# 加载计数器时最多重试的秒数和每次重试的间隔
+LOAD_RETRY_TIMEOUT = 5
+LOAD_RETRY_INTERVAL = 0.05
+
+# 一次性扣减一个订单中所有商品的库存,要么全部成功,要么全部不扣减
+# KEYS[1]: PENDING_KEY, KEYS[2..n+1]: 各商品的库存key
+# ARGV: 商品id1, 数量1, 商品id2, 数量2...
+# 返回值: 0 扣减成功; i 第i个商品库存不足; -i 第i个商品的库存还没有加载到redis中
+RESERVE_SCRIPT = '''
+local n = #KEYS - 1
+for i = 1, n do
+    local stock = redis.call('get', KEYS[i + 1])
+    if not stock then
+        return -i
+    end
+    if tonumber(stock) < tonumber(ARGV[2 * i]) then
+        return i
+    end
+end
+for i = 1, n do
+    redis.call('decrby', KEYS[i + 1], ARGV[2 * i])
+    redis.call('hincrby', KEYS[1], ARGV[2 * i - 1], ARGV[2 * i])
+end
+return 0
+'''
+
+# 订单创建失败时,归还已经扣减的库存
+RELEASE_SCRIPT = '''
+local n = #KEYS - 1
+for i = 1, n do
+    if redis.call('exists', KEYS[i + 1]) == 1 then
+        redis.call('incrby', KEYS[i + 1], ARGV[2 * i])
+    end
+    redis.call('hincrby', KEYS[1], ARGV[2 * i - 1], -tonumber(ARGV[2 * i]))
+end
+return 0
+'''
+
+# 版本号没有变化并且没有正在同步库存时,写入加载的库存,已经存在的计数器不会被覆盖
+# KEYS[1]: STOCK_GEN_KEY, KEYS[2]: RECONCILE_LOCK_KEY, KEYS[3..n]: 各商品的库存key
+# ARGV[1]: 读取数据时的版本号, ARGV[2]: 计数器的过期秒数, ARGV[3..n]: 各商品的库存
+# 返回值: 1 写入成功; 0 需要重新加载
+LOAD_SCRIPT = '''
+if (redis.call('get', KEYS[1]) or '0') ~= ARGV[1] or redis.call('exists', KEYS[2]) == 1 then
+    return 0
+end
+for i = 3, #KEYS do
+    redis.call('set', KEYS[i], ARGV[i], 'EX', ARGV[2], 'NX')
+end
+return 1
+'''
+
+# 把待同步的数据转移到处理中的hash,上一次同步失败留下的数据会被优先处理
+TAKE_PENDING_SCRIPT = '''
+if redis.call('exists', KEYS[2]) == 0 and redis.call('exists', KEYS[1]) == 1 then
+    redis.call('rename', KEYS[1], KEYS[2])
+end
+return redis.call('hgetall', KEYS[2])
+'''
+
+
+def _script_args(items):
+    keys = [PENDING_KEY] + [STOCK_KEY % sku_id for sku_id, count in items]
+    args = []
+    for sku_id, count in items:
+        args.extend([sku_id, count])
+    return keys, args
+
+
+def _load_counters(conn, sku_ids):
+    '''
+    把mysql中的商品库存加载到redis中,
+    还没有同步到mysql中的扣减数量要从库存中减掉,已经存在的计数器不会被覆盖
+
+    不使用锁,像seqlock一样检查版本号:在一个事务中读取待同步的数量和版本号,再读取mysql中的库存,
+    写入时版本号变化了或者正在同步库存,说明可能读到已经同步到mysql中的数量(会被重复扣减),
+    或者库存已经在后台被修改,稍后重新加载。不能在事务中调用,否则读到的是事务开始时的库存
+    :return: 是否加载成功
+    '''
+    script = conn.register_script(LOAD_SCRIPT)
+    deadline = time.time() + LOAD_RETRY_TIMEOUT
+    while True:
+        pipe = conn.pipeline()
+        pipe.hmget(PENDING_KEY, sku_ids)
+        pipe.hmget(PROCESSING_KEY, sku_ids)
+        pipe.get(STOCK_GEN_KEY)
+        pipe.exists(RECONCILE_LOCK_KEY)
+        pending, processing, gen, reconciling = pipe.execute()
+        gen = int(gen or 0)
+
+        if not reconciling:
+            stocks = dict(GoodsSKU.objects.filter(id__in=sku_ids).values_list('id', 'stock'))
+            keys = [STOCK_GEN_KEY, RECONCILE_LOCK_KEY]
+            args = [gen, settings.STOCK_COUNTER_TIMEOUT]
+            for sku_id, pending_count, processing_count in zip(sku_ids, pending, processing):
+                if sku_id in stocks:
+                    keys.append(STOCK_KEY % sku_id)
+                    args.append(stocks[sku_id] - int(pending_count or 0) - int(processing_count or 0))
+            if script(keys=keys, args=args):
+                return True
+
+        # 正在同步库存,或者加载期间数据发生了变化
+        if time.time() >= deadline:
+            return False
+        time.sleep(LOAD_RETRY_INTERVAL)
+
+
+def invalidate_counters(sku_ids):
+    '''
+    mysql中的库存被直接修改(后台修改库存,OrderCommitView1)后,删除redis中的库存计数器,
+    下次下单时从mysql中重新加载,需要在修改库存的事务提交之后调用
+    '''
+    if sku_ids:
+        pipe = get_redis_connection('default').pipeline()
+        pipe.delete(*[STOCK_KEY % int(sku_id) for sku_id in sku_ids])
+        pipe.incr(STOCK_GEN_KEY) # 正在加载的计数器使用的可能是修改前的库存
+        pipe.execute()
+
+
+def reserve_stock(items):
+    '''
+    在redis中原子地扣减一个订单中所有商品的库存,不需要锁定mysql中的数据行
+    :param items: [(商品id, 购买数量), ...]
+    :return: 库存不足或者不存在的商品id,全部扣减成功时返回None
+    '''
+    items = [(int(sku_id), int(count)) for sku_id, count in items]
+    conn = get_redis_connection('default')
+    script = conn.register_script(RESERVE_SCRIPT)
+    keys, args = _script_args(items)
+
+    # 第一次执行时,商品的库存可能还没有加载到redis中,加载后再执行一次
+    for i in range(2):
+        res = script(keys=keys, args=args)
+        if res == 0:
+            return None
+        if res > 0:
+            return items[res - 1][0]
+        _load_counters(conn, [sku_id for sku_id, count in items])
+
+    return items[-res - 1][0]
+
+
+def release_stock(items):
+    '''
+    归还reserve_stock扣减的库存
+    :param items: [(商品id, 购买数量), ...]
+    '''
+    items = [(int(sku_id), int(count)) for sku_id, count in items]
+    conn = get_redis_connection('default')
+    keys, args = _script_args(items)
+    conn.register_script(RELEASE_SCRIPT)(keys=keys, args=args)
+
+
+def update_stock(items, check_stock=False):
+    '''
+    用一条带CASE表达式的update语句,减少多个商品的库存,销量单独统计(见order.sales)
+    :param items: [(商品id, 数量), ...]
+    :param check_stock: 为True时只修改库存充足的商品
+    :return: 修改的行数,check_stock为True时小于商品种类数说明有商品库存不足
+    '''
+    counts = {}
+    for sku_id, count in items:
+        counts[int(sku_id)] = counts.get(int(sku_id), 0) + int(count)
+    if not counts:
+        return 0
+
+    stock_case = Case(*[When(id=sku_id, then=F('stock') - count) for sku_id, count in counts.items()],
+                      output_field=IntegerField())
+
+    skus = GoodsSKU.objects.filter(id__in=list(counts))
+    if check_stock:
+        enough = Q()
+        for sku_id, count in counts.items():
+            enough |= Q(id=sku_id, stock__gte=count)
+        skus = skus.filter(enough)
+
+    return skus.update(stock=stock_case)
+
+
+def reconcile_stock():
+    '''
+    把redis中已经扣减的库存同步到mysql中,由celery定时执行
+    注意:如果mysql提交成功后worker在删除PROCESSING_KEY之前崩溃,这批数据会被重复同步
+    :return: 同步的商品种类数
+    '''
+    conn = get_redis_connection('default')
+    lock = conn.lock(RECONCILE_LOCK_KEY, timeout=60)
+    if not lock.acquire(blocking=False): # 其他worker正在同步
+        return 0
+
+    try:
+        pending = conn.register_script(TAKE_PENDING_SCRIPT)(keys=[PENDING_KEY, PROCESSING_KEY])
+        # hgetall返回的是[field1, value1, field2, value2...]
+        pending = {int(sku_id): int(count) for sku_id, count in zip(pending[::2], pending[1::2])}
+
+        with transaction.atomic():
+            update_stock([(sku_id, count) for sku_id, count in pending.items() if count])
+
+        pipe = conn.pipeline()
+        pipe.delete(PROCESSING_KEY)
+        pipe.incr(STOCK_GEN_KEY)
+        pipe.execute()
+        invalidate_skus(pending.keys())
+    finally:
+        lock.release()
+
+    return len(pending)
@@ -1,3 +1,258 @@
-from django.test import TestCase
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils.http import urlencode
+
+from user.models import User, Address
+from order.models import OrderInfo
+from order.payment import reset_alipay, get_pay_url, sign_stats, load_stats
+from order.pay_poller import (PAY_PENDING_KEY, PAY_ATTEMPTS_KEY, CLAIM_SCRIPT,
+                              watch_payment, check_pending_payments, get_pay_failure)
+from order.stock import (STOCK_KEY, PENDING_KEY, STOCK_GEN_KEY, RECONCILE_LOCK_KEY, LOAD_SCRIPT,
+                         reserve_stock, release_stock, invalidate_counters)
+from order.views import parse_sku_ids
+from utils.testing import RedisTestCase
+
+
+class FakeAliPay(object):
+    '''
+    测试时代替支付宝sdk的客户端,不访问网络,
+    订单的支付结果由set_trade直接设置,在settings中设置ALIPAY_CLIENT_CLASS='order.tests.FakeAliPay'使用
+    '''
+    # 所有订单的查询结果 {订单id: 支付宝返回的数据}
+    trades = {}
+
+    def __init__(self, **kwargs):
+        self.options = kwargs
+
+    def api_alipay_trade_page_pay(self, out_trade_no, total_amount, subject, return_url=None, notify_url=None, **kwargs):
+        return urlencode({
+            'out_trade_no': out_trade_no,
+            'total_amount': total_amount,
+            'subject': subject,
+        })
+
+    def api_alipay_trade_query(self, out_trade_no=None, trade_no=None):
+        # 用户还没有登录支付宝付款时,支付宝返回交易不存在
+        return self.trades.get(out_trade_no, {'code': '40004', 'msg': 'Business Failed',
+                                              'sub_code': 'ACQ.TRADE_NOT_EXIST'})
+
+    @classmethod
+    def set_trade(cls, out_trade_no, trade_status='TRADE_SUCCESS', trade_no=None):
+        '''设置某个订单的支付结果'''
+        cls.trades[out_trade_no] = {
+            'code': '10000',
+            'msg': 'Success',
+            'out_trade_no': out_trade_no,
+            'trade_no': trade_no or 'fake%s' % out_trade_no,
+            'trade_status': trade_status,
+        }
+
+    @classmethod
+    def clear(cls):
+        cls.trades.clear()
+
+
+class ParseSkuIdsTest(TestCase):
+    def test_parse(self):
+        self.assertEqual(parse_sku_ids('1,3'), [1, 3])
+        self.assertEqual(parse_sku_ids('5'), [5])
+
+    def test_invalid(self):
+        # 商品id为空,不是数字或者重复
+        for sku_ids in ('1,', ',1', '1,a', '-1', '1,1', '1,01'):
+            self.assertIsNone(parse_sku_ids(sku_ids), sku_ids)
+
+
+class StockTest(RedisTestCase):
+    '''redis中扣减库存的lua脚本'''
+    def setUp(self):
+        super().setUp()
+        self.conn.set(STOCK_KEY % 1001, 5)
+        self.conn.set(STOCK_KEY % 1002, 1)
+
+    def get_stocks(self):
+        return [int(self.conn.get(STOCK_KEY % sku_id)) for sku_id in (1001, 1002)]
+
+    def test_reserve_and_release(self):
+        items = [(1001, 2), (1002, 1)]
+        self.assertIsNone(reserve_stock(items))
+        self.assertEqual(self.get_stocks(), [3, 0])
+        self.assertEqual(self.conn.hgetall(PENDING_KEY), {b'1001': b'2', b'1002': b'1'})
+
+        release_stock(items)
+        self.assertEqual(self.get_stocks(), [5, 1])
+        self.assertEqual(self.conn.hgetall(PENDING_KEY), {b'1001': b'0', b'1002': b'0'})
+
+    def test_reserve_all_or_nothing(self):
+        # 第二个商品库存不足,第一个商品也不扣减
+        self.assertEqual(reserve_stock([(1001, 2), (1002, 2)]), 1002)
+        self.assertEqual(self.get_stocks(), [5, 1])
+        self.assertFalse(self.conn.exists(PENDING_KEY))
+
+    def test_reserve_missing_sku(self):
+        # 商品不存在,加载库存后计数器仍然不存在
+        self.assertEqual(reserve_stock([(1001, 1), (1009, 1)]), 1009)
+        self.assertEqual(self.get_stocks(), [5, 1])
+        self.assertFalse(self.conn.exists(STOCK_KEY % 1009))
+
+    def test_invalidate_counters(self):
+        invalidate_counters([1001])
+        self.assertFalse(self.conn.exists(STOCK_KEY % 1001))
+        self.assertEqual(self.conn.get(STOCK_GEN_KEY), b'1')
+
+    def test_load_script(self):
+        load = self.conn.register_script(LOAD_SCRIPT)
+        keys = [STOCK_GEN_KEY, RECONCILE_LOCK_KEY, STOCK_KEY % 1003, STOCK_KEY % 1001]
+        args = [0, 600, 7, 9]
+
+        # 读取数据后版本号变化了,或者正在同步库存,都不写入
+        self.conn.set(STOCK_GEN_KEY, 1)
+        self.assertEqual(load(keys=keys, args=args), 0)
+        self.conn.set(RECONCILE_LOCK_KEY, 'token')
+        self.assertEqual(load(keys=keys, args=[1, 600, 7, 9]), 0)
+        self.assertFalse(self.conn.exists(STOCK_KEY % 1003))
+
+        # 写入时不覆盖已经存在的计数器
+        self.conn.delete(RECONCILE_LOCK_KEY)
+        self.assertEqual(load(keys=keys, args=[1, 600, 7, 9]), 1)
+        self.assertEqual(self.conn.get(STOCK_KEY % 1003), b'7')
+        self.assertEqual(self.get_stocks(), [5, 1])
+        self.assertGreater(self.conn.ttl(STOCK_KEY % 1003), 0)
+
+
+@override_settings(ALIPAY_CLIENT_CLASS='order.tests.FakeAliPay', PAY_CHECK_MAX_ATTEMPTS=3)
+class PayPollerTest(RedisTestCase):
+    '''使用FakeAliPay测试后台查询支付结果'''
+    def setUp(self):
+        super().setUp()
+        FakeAliPay.clear()
+        reset_alipay()
+
+        user = User.objects.create_user('smart', 'smart@example.com', '123456')
+        addr = Address.objects.create(user=user, receiver='smart', addr='北京市', phone='13800000000')
+        self.order_ids = []
+        for i in range(2):
+            order = OrderInfo.objects.create(order_id='2019121012000%d' % i, user=user, addr=addr, pay_method=3,
+                                             total_count=1, total_price=10, transit_price=10)
+            self.order_ids.append(order.order_id)
+        self.order_id = self.order_ids[0]
+        watch_payment(self.order_id)
+
+    def tearDown(self):
+        FakeAliPay.clear()
+        reset_alipay()
+        super().tearDown()
+
+    def check_now(self, order_ids=None):
+        '''让订单立即到达查询时间,然后查询一批订单'''
+        for order_id in order_ids or [self.order_id]:
+            self.conn.zadd(PAY_PENDING_KEY, {order_id: 0})
+        return check_pending_payments()
+
+    def get_order(self, order_id=None):
+        return OrderInfo.objects.get(order_id=order_id or self.order_id)
+
+    def test_success(self):
+        FakeAliPay.set_trade(self.order_id)
+        self.assertEqual(self.check_now(), 1)
+
+        order = self.get_order()
+        self.assertEqual(order.order_status, 4)
+        self.assertEqual(order.trade_no, 'fake%s' % self.order_id)
+        self.assertIsNone(self.conn.zscore(PAY_PENDING_KEY, self.order_id))
+        self.assertIsNone(get_pay_failure(self.order_id))
+
+    def test_wait_buyer_pay_backoff(self):
+        FakeAliPay.set_trade(self.order_id, trade_status='WAIT_BUYER_PAY')
+        now = time.time()
+        self.check_now()
+
+        self.assertEqual(self.get_order().order_status, 1)
+        self.assertEqual(self.conn.hget(PAY_ATTEMPTS_KEY, self.order_id), b'1')
+        # 第一次退避后,下一次查询的间隔翻倍
+        self.assertGreaterEqual(self.conn.zscore(PAY_PENDING_KEY, self.order_id),
+                                now + settings.PAY_CHECK_BASE_DELAY * 2)
+
+        self.check_now()
+        self.assertEqual(self.conn.hget(PAY_ATTEMPTS_KEY, self.order_id), b'2')
+
+    def test_max_attempts(self):
+        # 用户一直没有付款,支付宝返回交易不存在,查询PAY_CHECK_MAX_ATTEMPTS次后放弃
+        for i in range(3):
+            self.assertIsNotNone(self.conn.zscore(PAY_PENDING_KEY, self.order_id))
+            self.check_now()
+
+        self.assertIsNone(self.conn.zscore(PAY_PENDING_KEY, self.order_id))
+        self.assertIsNone(self.conn.hget(PAY_ATTEMPTS_KEY, self.order_id))
+        self.assertEqual(self.get_order().order_status, 1)
+        self.assertIsNone(get_pay_failure(self.order_id))
+
+    def test_failure(self):
+        FakeAliPay.set_trade(self.order_id, trade_status='TRADE_CLOSED')
+        self.check_now()
+
+        self.assertEqual(get_pay_failure(self.order_id), {'code': '10000', 'trade_status': 'TRADE_CLOSED'})
+        self.assertIsNone(self.conn.zscore(PAY_PENDING_KEY, self.order_id))
+        self.assertEqual(self.get_order().order_status, 1)
+
+    def test_query_error(self):
+        # 第一个订单查询出错时推迟查询,不影响同一批中的其他订单
+        failing_id, paid_id = self.order_ids
+        FakeAliPay.set_trade(paid_id)
+        query = FakeAliPay.api_alipay_trade_query
+
+        def api_alipay_trade_query(alipay, out_trade_no=None, trade_no=None):
+            if out_trade_no == failing_id:
+                raise ConnectionError
+            return query(alipay, out_trade_no, trade_no)
+
+        now = time.time()
+        with mock.patch.object(FakeAliPay, 'api_alipay_trade_query', api_alipay_trade_query):
+            self.assertEqual(self.check_now(self.order_ids), 2)
+
+        self.assertEqual(self.get_order(paid_id).order_status, 4)
+        self.assertEqual(self.conn.hget(PAY_ATTEMPTS_KEY, failing_id), b'1')
+        self.assertGreater(self.conn.zscore(PAY_PENDING_KEY, failing_id), now)
+
+    def test_claim(self):
+        # 一批订单被取出后,再次执行时不会取出同一批订单
+        self.conn.zadd(PAY_PENDING_KEY, {self.order_id: 0})
+        claim = self.conn.register_script(CLAIM_SCRIPT)
+        now = time.time()
+        self.assertEqual(claim(keys=[PAY_PENDING_KEY], args=[now, 10, now + 60]), [self.order_id.encode()])
+        self.assertEqual(claim(keys=[PAY_PENDING_KEY], args=[now, 10, now + 60]), [])
+
+
+@override_settings(ALIPAY_CLIENT_CLASS='order.tests.FakeAliPay')
+class PayMetricsTest(TestCase):
+    '''支付宝客户端的缓存和耗时统计'''
+    def setUp(self):
+        reset_alipay()
+        sign_stats.reset()
+        load_stats.reset()
+
+    def tearDown(self):
+        reset_alipay()
+
+    def test_metrics(self):
+        # 密钥只在第一次生成支付链接时加载
+        for i in range(2):
+            self.assertIn('out_trade_no=1', get_pay_url('1', 10, '天天生鲜1'))
+        self.assertEqual(sign_stats.snapshot()['count'], 2)
+        self.assertEqual(load_stats.snapshot()['count'], 1)
+
+    def test_view(self):
+        url = reverse('order:pay_metrics')
+        User.objects.create_user('smart', 'smart@example.com', '123456')
+        self.client.login(username='smart', password='123456')
+        self.assertEqual(self.client.get(url).json(), {'res': 0, 'errmsg': '没有权限'})
+
+        User.objects.create_user('admin', 'admin@example.com', '123456', is_staff=True)
+        self.client.login(username='admin', password='123456')
+        response = self.client.get(url).json()
+        self.assertEqual(response['res'], 1)
+        self.assertEqual(set(response['metrics']), {'sign', 'load'})
@@ -1,10 +1,11 @@
 from django.conf.urls import url,include
-from order.views import OrderPlaceView, OrderCommitView,OrderPayView,CheckPayView,CommentView
+from order.views import OrderPlaceView, OrderCommitView,OrderPayView,CheckPayView,PayMetricsView,CommentView
 
 urlpatterns = [
     url(r'^place$',OrderPlaceView.as_view(),name='place'), # 显示订单页面
     url(r'^commit$',OrderCommitView.as_view(),name='commit'), # 提交订单
     url(r'^pay$',OrderPayView.as_view(),name='pay'), # 订单支付
     url(r'^check$',CheckPayView.as_view(),name='check'), # 查询支付交易结果
+    url(r'^pay/metrics$',PayMetricsView.as_view(),name='pay_metrics'), # 支付宝客户端的耗时统计
     url(r'^comment/(?P<order_id>.+)$',CommentView.as_view(),name='comment'), # 订单评论
 ]
@@ -8,16 +8,50 @@ from django.conf import settings
 from user.models import Address
 from goods.models import GoodsSKU
 from order.models import OrderInfo, OrderGoods
+from cart.hydration import hydrate_cart
+from cart.repository import CartRepository
+from goods.sku_cache import get_skus
+from goods.catalog import invalidate_comments
+from goods import rankings
+from goods import static_pages
+from celery_tasks import tasks
+from order.stock import reserve_stock, release_stock, update_stock, invalidate_counters
+from order.sales import record_sales
+from order.payment import get_pay_url, get_metrics
+from order.pay_poller import watch_payment, get_retry_after, get_pay_failure
 
 from utils.mixin import LoginRequiredMixin
-from django_redis import get_redis_connection
-from alipay import AliPay
 from datetime import datetime
-import os
-import time
 
 # Create your views here.
 
+def create_order_goods(order,skus,items):
+    '''
+    用一条insert语句添加订单中的所有商品
+    :param skus: {商品id: 商品对象}
+    :param items: [(商品id, 购买数量), ...]
+    '''
+    OrderGoods.objects.bulk_create([
+        OrderGoods(order=order, sku=skus[sku_id], count=count, price=skus[sku_id].price)
+        for sku_id, count in items
+    ])
+
+
+def parse_sku_ids(sku_ids):
+    '''
+    解析前端传来的要购买的商品id,如"1,3"
+    :return: 商品id(int)的列表,商品id不是数字或者有重复时返回None
+    '''
+    sku_ids = sku_ids.split(',')
+    if not all(sku_id.isdigit() for sku_id in sku_ids):
+        return None
+    sku_ids = [int(sku_id) for sku_id in sku_ids]
+    # 同一个商品出现多次时,会按购物车中的数量重复扣减库存和添加订单商品
+    if len(set(sku_ids)) != len(sku_ids):
+        return None
+    return sku_ids
+
+
 class OrderPlaceView(LoginRequiredMixin,View):
     '''
     根据购物车中的货品，生成订单页面
@@ -29,21 +63,10 @@ class OrderPlaceView(LoginRequiredMixin,View):
             return redirect(reverse('cart:show'))
 
         # 从redis中获取商品的数量
-        sr_conn = get_redis_connection('default')
-        cart_key = "cart_%d"%user.id
+        counts = CartRepository(user.id).get_counts(sku_ids)
 
-        skus = []
-        total_count = 0
-        total_amount = 0
-        for sku_id in sku_ids:
-            sku = GoodsSKU.objects.get(id=sku_id)
-            count = sr_conn.hget(cart_key,sku_id)
-            amount = sku.price * int(count)
-            sku.count = count
-            sku.amount = amount
-            skus.append(sku)
-            total_count += int(count)
-            total_amount += amount
+        # 一次性获取所有要购买的商品,并计算小计和总计
+        skus, total_count, total_amount = hydrate_cart(dict(zip(sku_ids,counts)))
 
         transit_price = 10 # 随便定的运费
 
@@ -89,6 +112,13 @@ class OrderCommitView1(View):
         except Address.DoesNotExist:
             return JsonResponse({'res':3, 'errmsg':'地址非法'})
 
+        sku_ids = parse_sku_ids(sku_ids)
+        if sku_ids is None:
+            return JsonResponse({'res':4, 'errmsg':'商品不存在'})
+
+        cart = CartRepository(user.id)
+        counts = cart.get_counts(sku_ids)
+
         order_id = datetime.now().strftime('%Y%m%d%H%M%S') + str(user.id)
         transit_price = 10
         total_count = 0
@@ -96,64 +126,64 @@ class OrderCommitView1(View):
 
         save_id = transaction.savepoint() # 设置事务的回退点
         try:
-            order = OrderInfo.objects.create(
-                order_id=order_id,
-                user=user,
-                addr=addr,
-                pay_method=pay_method,
-                total_count=total_count,
-                total_price=total_price,
-                transit_price=transit_price
-            )
-
-            sr_conn = get_redis_connection('default')
-            cart_key = 'cart_%d'%user.id
+            # 查询时一次性锁定所有要购买的商品，其他进程或线程不能在查询这些数据
+            skus = GoodsSKU.objects.select_for_update().in_bulk(sku_ids)
 
-            sku_ids = sku_ids.split(',')
-            for sku_id in sku_ids:
-                try:
-                    # 查询时锁定这行数据，其他进程或线程不能在查询这条数据
-                    sku = GoodsSKU.objects.select_for_update().get(id=sku_id)
-                except Exception as e:
+            items = []
+            for sku_id,count in zip(sku_ids,counts):
+                sku = skus.get(sku_id)
+                if sku is None or not count:
                     transaction.savepoint_rollback(save_id)
                     return JsonResponse({'res':4, 'errmsg':'商品不存在'})
 
-                count = sr_conn.hget(cart_key,sku_id)
                 if int(count) > sku.stock:
                     transaction.savepoint_rollback(save_id)
                     return JsonResponse({'res': 6, 'errmsg': '商品库存不足'})
 
-                OrderGoods.objects.create(
-                    order=order,
-                    sku=sku,
-                    count=count,
-                    price=sku.price
-                )
-                sku.stock -= int(count)
-                sku.sales += int(count)
-                sku.save()
-
-                amount = sku.price * int(count)
+                items.append((sku.id,int(count)))
                 total_count += int(count)
-                transit_price += amount
+                total_price += sku.price * int(count)
 
-            order.total_count = total_count
-            order.total_price = total_price
-            order.save()
+            # 用一条update语句修改所有商品的库存
+            if update_stock(items, check_stock=True) != len(skus):
+                transaction.savepoint_rollback(save_id)
+                return JsonResponse({'res': 6, 'errmsg': '商品库存不足'})
+
+            order = OrderInfo.objects.create(
+                order_id=order_id,
+                user=user,
+                addr=addr,
+                pay_method=pay_method,
+                total_count=total_count,
+                total_price=total_price,
+                transit_price=transit_price
+            )
+            create_order_goods(order,skus,items)
         except Exception as e:
             transaction.savepoint_rollback(save_id)
             return JsonResponse({'res':7, 'errmsg':'数据库插入失败'})
 
         transaction.savepoint_commit(save_id)
-        sr_conn.hdel(cart_key,*sku_ids)
+        sales_items = [(skus[sku_id].type_id, sku_id, count) for sku_id, count in items]
+
+        # redis中的操作都在事务提交后执行,事务提交失败时不会删除购物车或者记录销量
+        def after_commit():
+            # 直接修改了mysql中的库存,删除redis中的库存计数器,下次从mysql中重新加载
+            invalidate_counters([sku_id for sku_id, count in items])
+            cart.remove(sku_ids)
+            # 在redis中记录销量,并增加商品在种类销量排行中的分数
+            record_sales(sales_items)
+            rankings.incr_sales(sales_items)
+        transaction.on_commit(after_commit)
 
         return JsonResponse({'res': 5, 'message': '创建成功'})
 
 
 class OrderCommitView(View):
     '''
-    向数据库中添加订单信息，采用乐观锁控制并发访问，
-    必须改变mysql数据库默认的事务级别为，改时其他事务不可见
+    向数据库中添加订单信息，库存在redis中原子地扣减，不再锁定或者反复重试mysql中的数据行，
+    扣减后的库存和销量由celery定时同步到mysql中。
+    只有添加订单的语句在事务中，redis中的操作都在事务之外，订单没有创建成功时归还扣减的库存
     '''
     def post(self,request):
         user = request.user
@@ -179,82 +209,59 @@ class OrderCommitView(View):
             # 地址不存在
             return JsonResponse({'res':3, 'errmsg':'地址非法'})
 
+        # 从redis中获取用户所要购买的商品的数量
+        sku_ids = parse_sku_ids(sku_ids)
+        if sku_ids is None:
+            return JsonResponse({'res': 4, 'errmsg': '商品不存在'})
+
+        cart = CartRepository(user.id)
+        counts = cart.get_counts(sku_ids)
+
+        # 一次性获取所有要购买的商品
+        skus = get_skus(sku_ids)
+        for sku_id, count in zip(sku_ids, counts):
+            if sku_id not in skus or not count:
+                # 商品不存在
+                return JsonResponse({'res': 4, 'errmsg': '商品不存在'})
+        items = list(zip(sku_ids, counts))
+
+        # 在redis中一次性扣减所有商品的库存
+        if reserve_stock(items) is not None:
+            return JsonResponse({'res': 6, 'errmsg': '商品库存不足'})
+
         order_id = datetime.now().strftime('%Y%m%d%H%M%S') + str(user.id)
 
         # 运费
         transit_price = 10
 
         # 总数目和总金额
-        total_count = 0
-        total_price = 0
+        total_count = sum(count for sku_id, count in items)
+        total_price = sum(skus[sku_id].price * count for sku_id, count in items)
 
-        # 设置事务保存点
-        save_id = transaction.savepoint()
         try:
-            order = OrderInfo.objects.create(order_id=order_id,
-                                             user=user,
-                                             addr=addr,
-                                             pay_method=pay_method,
-                                             total_count=total_count,
-                                             total_price=total_price,
-                                             transit_price=transit_price)
-            conn = get_redis_connection('default')
-            cart_key = 'cart_%d' % user.id
-            sku_ids = sku_ids.split(',')
-
-            for sku_id in sku_ids:
-                # 尝试查询三次数据库中这个商品的库存，如果有一次查询到的库存和修改时的库存一致，购买成功
-                for i in range(3):
-                    # 获取商品的信息
-                    try:
-                        sku = GoodsSKU.objects.get(id=sku_id)
-                    except:
-                        # 商品不存在
-                        transaction.savepoint_rollback(save_id)
-                        return JsonResponse({'res': 4, 'errmsg': '商品不存在'})
-
-                    # 从redis中获取用户所要购买的商品的数量
-                    count = conn.hget(cart_key, sku_id)
-
-                    if int(count) > sku.stock:
-                        transaction.savepoint_rollback(save_id)
-                        return JsonResponse({'res': 6, 'errmsg': '商品库存不足'})
-
-                    orgin_stock = sku.stock
-                    new_stock = orgin_stock - int(count)
-                    new_sales = sku.sales + int(count)
-
-                    # 返回受影响的行数
-                    # 只有在前面查询到的库存和现在更新时的库存一致时，才会更新库存和销售数据
-                    res = GoodsSKU.objects.filter(id=sku_id, stock=orgin_stock).update(stock=new_stock, sales=new_sales)
-                    if res == 0:
-                        if i == 2:
-                            # 尝试的第3次
-                            transaction.savepoint_rollback(save_id)
-                            return JsonResponse({'res': 7, 'errmsg': '下单失败2'})
-                        continue
-
-                    OrderGoods.objects.create(order=order,
-                                              sku=sku,
-                                              count=count,
-                                              price=sku.price)
-
-                    amount = sku.price * int(count)
-                    total_count += int(count)
-                    total_price += amount
-
-                    break
-
-            order.total_count = total_count
-            order.total_price = total_price
-            order.save()
-
+            # 订单和订单中的商品在一个事务中添加，事务提交失败时也会进入except
+            with transaction.atomic():
+                order = OrderInfo.objects.create(order_id=order_id,
+                                                 user=user,
+                                                 addr=addr,
+                                                 pay_method=pay_method,
+                                                 total_count=total_count,
+                                                 total_price=total_price,
+                                                 transit_price=transit_price)
+
+                # 一条insert语句添加订单中所有的商品
+                create_order_goods(order, skus, items)
         except Exception as e:
-            transaction.savepoint_rollback(save_id)
+            # 订单没有创建成功,归还扣减的库存
+            release_stock(items)
             return JsonResponse({'res': 7, 'errmsg': '数据库插入失败'})
 
-        transaction.savepoint_commit(save_id)
-        conn.hdel(cart_key, *sku_ids)
+        # 事务已经提交
+        cart.remove(sku_ids)
+        # 在redis中记录销量,并增加商品在种类销量排行中的分数
+        sales_items = [(skus[sku_id].type_id, sku_id, count) for sku_id, count in items]
+        record_sales(sales_items)
+        rankings.incr_sales(sales_items)
 
         return JsonResponse({'res': 5, 'message': '创建成功'})
 
@@ -283,36 +290,21 @@ class OrderPayView(View):
         except OrderInfo.DoesNotExist:
             return JsonResponse({'res': 2, 'errmsg': '订单错误'})
 
-        # 使用python sdk调用支付宝的支付接口
-        alipay = AliPay(
-            appid="2016090800464054",  # 应用id
-            app_notify_url=None,  # 默认回调url
-            app_private_key_path=os.path.join(settings.BASE_DIR, 'apps/order/app_private_key.pem'),
-            alipay_public_key_path=os.path.join(settings.BASE_DIR, 'apps/order/alipay_public_key.pem'),
-            # 支付宝的公钥，验证支付宝回传消息使用，不是你自己的公钥,
-            sign_type="RSA2",  # RSA 或者 RSA2
-            debug=True  # 默认False
-        )
-
-        # 调用支付接口
-        # 电脑网站支付，需要跳转到https://openapi.alipaydev.com/gateway.do? + order_string
+        # 使用python sdk调用支付宝的支付接口，客户端和密钥在进程中缓存，不需要每次都加载
         total_pay = order.total_price + order.transit_price
-        order_string = alipay.api_alipay_trade_page_pay(
-            out_trade_no=order_id, # 订单id
-            total_amount=str(total_pay), # 支付总金额
-            subject='天天生鲜 订单号:%s'%order_id,
-            return_url=None,
-            notify_url=None  # 可选, 不填则使用默认notify url
-        )
+        pay_url = get_pay_url(order_id, total_pay, '天天生鲜 订单号:%s'%order_id)
+
+        # 由celery在后台查询支付结果
+        watch_payment(order_id, restart=True)
 
         # 返回支付页面地址给前端
-        pay_url = 'https://openapi.alipaydev.com/gateway.do?' + order_string
         return JsonResponse({'res':3, 'pay_url':pay_url})
 
 
 class CheckPayView(View):
     '''
-    主动向支付宝开放平台发送支付结果查询请求，查看是否支付成功
+    查询订单的支付结果，支付宝的查询接口由celery在后台按指数退避的方式批量调用，
+    此处只读取查询结果，立即返回，浏览器根据返回的retry_after（后台下一次查询的时间）定时轮询
     '''
     def post(self,request):
         # 用户是否登录
@@ -329,63 +321,32 @@ class CheckPayView(View):
             order = OrderInfo.objects.get(
                 order_id=order_id,
                 user=user,
-                pay_method=3,
-                order_status=1
+                pay_method=3
             )
         except OrderInfo.DoesNotExist:
             return JsonResponse({'res': 2, 'errmsg': '订单错误'})
 
-        alipay = AliPay(
-            appid="2016090800464054",  # 应用id
-            app_notify_url=None,  # 默认回调url
-            app_private_key_path=os.path.join(settings.BASE_DIR, 'apps/order/app_private_key.pem'),
-            alipay_public_key_path=os.path.join(settings.BASE_DIR, 'apps/order/alipay_public_key.pem'),
-            # 支付宝的公钥，验证支付宝回传消息使用，不是你自己的公钥,
-            sign_type="RSA2",  # RSA 或者 RSA2
-            debug=True  # 默认False
-        )
-
-        # 循环调用支付宝的支付结果查询api
-        while True:
-            response = alipay.api_alipay_trade_query(order_id)
-            # 返回结果格式
-            # response = {
-            #         "trade_no": "2017032121001004070200176844", # 支付宝交易号
-            #         "code": "10000", # 接口调用是否成功
-            #         "invoice_amount": "20.00",
-            #         "open_id": "20880072506750308812798160715407",
-            #         "fund_bill_list": [
-            #             {
-            #                 "amount": "20.00",
-            #                 "fund_channel": "ALIPAYACCOUNT"
-            #             }
-            #         ],
-            #         "buyer_logon_id": "csq***@sandbox.com",
-            #         "send_pay_date": "2017-03-21 13:29:17",
-            #         "receipt_amount": "20.00",
-            #         "out_trade_no": "out_trade_no15",
-            #         "buyer_pay_amount": "20.00",
-            #         "buyer_user_id": "2088102169481075",
-            #         "msg": "Success",
-            #         "point_amount": "0.00",
-            #         "trade_status": "TRADE_SUCCESS", # 支付结果
-            #         "total_amount": "20.00"
-            # }
-
-            code = response.get('code')
-            trade_status = response.get('trade_status')
-            if code == '10000' and trade_status == 'TRADE_SUCCESS':
-                order.trade_no = response.get('trade_no')
-                order.order_status = 4 # 订单状态变为待评价
-                order.save()
-                return JsonResponse({'res':3, 'message':'支付成功'})
-            elif code == '40004' or (code == '10000' and trade_status == 'WAIT_BUYER_PAY'):
-                # 等待买家付款
-                # 业务处理失败，可能一会就会成功
-                time.sleep(15)
-                continue
-            else:
-                return JsonResponse({'res':4, 'errmsg':'支付失败','code':code,'trade_status':trade_status})
+        if order.order_status == 1:
+            failure = get_pay_failure(order_id)
+            if failure is not None:
+                return JsonResponse({'res':4, 'errmsg':'支付失败','code':failure['code'],'trade_status':failure['trade_status']})
+
+            # 还没有查询到支付结果，等待后台查询
+            watch_payment(order_id)
+            return JsonResponse({'res':5, 'message':'等待支付', 'retry_after':get_retry_after(order_id)})
+
+        return JsonResponse({'res':3, 'message':'支付成功'})
+
+
+class PayMetricsView(View):
+    '''
+    本进程中生成支付链接和加载密钥的耗时统计,只有管理员可以访问
+    '''
+    def get(self,request):
+        if not request.user.is_staff:
+            return JsonResponse({'res':0, 'errmsg':'没有权限'})
+
+        return JsonResponse({'res':1, 'metrics':get_metrics()})
 
 
 class CommentView(LoginRequiredMixin,View):
@@ -412,7 +373,7 @@ class CommentView(LoginRequiredMixin,View):
         context = {'order':order}
         return render(request,'order_comment.html',context)
 
-    def post(self,request):
+    def post(self,request,order_id=None):
         user = request.user
 
         order_id = int(request.POST.get('order_id'))
@@ -427,6 +388,7 @@ class CommentView(LoginRequiredMixin,View):
         total_count = int(request.POST.get("total_count"))
 
         # 获取每个商品的id和评论内容，并更新到数据库中
+        commented_sku_ids = []
         for i in range(1,total_count+1):
             sku_id = request.POST.get('sku_%d'%i)
             sku_comment = request.POST.get('content_%d'%i)
@@ -435,9 +397,16 @@ class CommentView(LoginRequiredMixin,View):
                 order_goods = OrderGoods.objects.get(sku_id=sku_id,order=order)
                 order_goods.comment = sku_comment
                 order_goods.save()
+                commented_sku_ids.append(order_goods.sku_id)
             except OrderGoods.DoesNotExist:
                 continue
 
+        # 商品有了新的评论,详情页重新获取评论,并重新生成静态详情页
+        invalidate_comments(commented_sku_ids)
+        if commented_sku_ids:
+            static_pages.mark_dirty(commented_sku_ids)
+            tasks.schedule_static_pages()
+
         # 更新订单状态为完成
         order.order_status = 5
         order.save()
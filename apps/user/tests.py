@@ -1,3 +1,59 @@
+from datetime import datetime
+from decimal import Decimal
+
 from django.test import TestCase
+from django.urls import reverse
+
+from user.models import User, Address
+from order.models import OrderInfo
+from utils.pagination import encode_cursor, decode_cursor, keyset_page
+
+
+class CursorTest(TestCase):
+    def test_encode_decode(self):
+        cursor = encode_cursor([datetime(2019, 12, 10, 12, 0, 1), Decimal('10.50'), '201912101200001'])
+        self.assertEqual(decode_cursor(cursor, 3), ['2019-12-10T12:00:01', '10.50', '201912101200001'])
+
+    def test_malformed(self):
+        # 不是base64,不是json,不是列表,或者字段个数不对
+        self.assertIsNone(decode_cursor('!!!', 2))
+        self.assertIsNone(decode_cursor('YWJj', 2))
+        self.assertIsNone(decode_cursor(encode_cursor({'a': 1}), 1))
+        self.assertIsNone(decode_cursor(encode_cursor([1, 2, 3]), 2))
+
+
+class UserOrderTest(TestCase):
+    '''用户中心订单页的键集分页'''
+    ordering = ['-create_time', '-order_id']
+
+    def setUp(self):
+        self.user = User.objects.create_user('smart', 'smart@example.com', '123456')
+        addr = Address.objects.create(user=self.user, receiver='smart', addr='北京市', phone='13800000000')
+        for i in range(5):
+            OrderInfo.objects.create(order_id='2019121012000%d' % i, user=self.user, addr=addr, pay_method=3,
+                                     total_count=1, total_price=10, transit_price=10)
+        self.orders = OrderInfo.objects.filter(user=self.user)
+
+    def test_keyset_page(self):
+        # 依次用上一页返回的cursor翻页,和一次取出所有订单的顺序一致
+        order_ids = []
+        cursor = None
+        for i in range(3):
+            objects, cursor = keyset_page(self.orders, self.ordering, cursor, 2)
+            order_ids.extend(order.order_id for order in objects)
+        self.assertIsNone(cursor)
+        self.assertEqual(order_ids, [order.order_id for order in self.orders.order_by(*self.ordering)])
+
+    def test_keyset_page_malformed_cursor(self):
+        # cursor格式不正确时返回第一页
+        first, cursor = keyset_page(self.orders, self.ordering, None, 2)
+        objects, next_cursor = keyset_page(self.orders, self.ordering, 'not-a-cursor', 2)
+        self.assertEqual(objects, first)
+        self.assertEqual(next_cursor, cursor)
 
-# Create your tests here.
+    def test_order_page_out_of_range(self):
+        self.client.login(username='smart', password='123456')
+        for page in (0, 100):
+            response = self.client.get(reverse('user:order', kwargs={'page': page}))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.context['page_number'], 1)
@@ -5,17 +5,19 @@ from django.core.mail import send_mail
 from django.contrib.auth import authenticate,login,logout
 from django.conf import settings
 from django.core.paginator import Paginator
+from django.db.models import Prefetch
 
 from user.models import User,Address
-from goods.models import GoodsSKU
+from goods.sku_cache import get_skus
 from order.models import OrderInfo,OrderGoods
 
 from utils.mixin import LoginRequiredMixin
+from utils.pagination import keyset_page, encode_cursor
 from celery_tasks.tasks import send_reg_active_mail
+from cart.repository import HistoryRepository
 
 from itsdangerous import TimedJSONWebSignatureSerializer as Tjsser
 from itsdangerous import SignatureExpired
-from django_redis import get_redis_connection
 import re
 
 # Create your views here.
@@ -163,15 +165,17 @@ class UserInfoView(LoginRequiredMixin,View):
         user = request.user
         default_address = Address.objects.get_default_address(user)
 
-        # 从redis中,获取用户的最近5条浏览记录的商品skuid
+        # 从redis中,获取用户的最近USER_HISTORY_LENGTH条浏览记录的商品skuid
         # 数据存储格式为:history_userid:[skuid1,skuid2,skuid3...]
-        sr = get_redis_connection()
-        skuid_li = sr.lrange('history_%d'%user.id,0,4)
+        history = HistoryRepository(user.id)
+        skuid_li = history.recent()
 
-        goods_li = []
-        for skuid in skuid_li:
-            goods = GoodsSKU.objects.get(id=skuid)
-            goods_li.append(goods)
+        # 一次性获取所有浏览过的商品,保持浏览记录的顺序
+        skus = get_skus(skuid_li)
+        goods_li = [skus[skuid] for skuid in skuid_li if skuid in skus]
+
+        # 已经被删除的商品,从浏览记录中删除
+        history.prune([skuid for skuid in skuid_li if skuid not in skus])
 
         context = {'page':'user','address':default_address,'goods_li':goods_li}
         return render(request,'user_center_info.html',context)
@@ -183,28 +187,40 @@ class UserOrderView(LoginRequiredMixin,View):
     '''
     def get(self,request,page):
         user = request.user
-        orders = OrderInfo.objects.filter(user=user).order_by('-create_time')
-
-        for order in orders:
-            order_skus = OrderGoods.objects.filter(order_id=order.order_id)
-            for order_sku in order_skus:
-                order_sku.amount = order_sku.count * order_sku.price
+        page_size = settings.USER_ORDER_PAGE_SIZE
 
-            order.order_skus = order_skus
-            order.status_name = OrderInfo.ORDER_STATUS[order.order_status]
+        # 只在加载当前页的订单时,用一条查询获取这些订单中的所有商品
+        ordering = ['-create_time', '-order_id']
+        orders = OrderInfo.objects.filter(user=user).order_by(*ordering).prefetch_related(
+            Prefetch('ordergoods_set', queryset=OrderGoods.objects.select_related('sku'), to_attr='order_skus'))
 
-        # 分页显示
-        paginator = Paginator(orders,1)
+        # 分页显示,页码由数据库中的订单数计算
+        paginator = Paginator(orders, page_size)
 
         try:
             page = int(page)
         except Exception as e:
             page = 1
-        if page > paginator.num_pages:
+        if page < 1 or page > paginator.num_pages:
             page = 1
 
-        # 获取当前请求页对象，其中包括该页要显示的所有数据
-        order_page = paginator.get_page(page)
+        # 获取当前请求页的订单，都只从数据库中取出当前页的订单
+        after = request.GET.get('after') if page > 1 else None
+        if page == 1 or after:
+            # 第一页，或者点击下一页时带有上一页最后一个订单的位置，使用键集分页，翻到很深的页也不会变慢
+            order_page, next_cursor = keyset_page(orders, ordering, after, page_size)
+        else:
+            # 直接点击页码时，使用offset分页
+            order_page = list(paginator.page(page))
+            next_cursor = None
+            if page < paginator.num_pages:
+                last = order_page[-1]
+                next_cursor = encode_cursor([last.create_time, last.order_id])
+
+        for order in order_page:
+            for order_sku in order.order_skus:
+                order_sku.amount = order_sku.count * order_sku.price
+            order.status_name = order.get_order_status_display()
 
         if paginator.num_pages < 5:
             pages = range(1,paginator.num_pages+1)
@@ -215,7 +231,8 @@ class UserOrderView(LoginRequiredMixin,View):
         else:
             pages = range(page-2,page+3)
 
-        context = {'order_page':order_page,'pages':pages,'page':'order'}
+        context = {'order_page':order_page,'page_number':page,'next_cursor':next_cursor,
+                   'pages':pages,'page':'order'}
         return render(request,'user_center_order.html',context)
 
 
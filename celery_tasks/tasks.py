@@ -8,13 +8,49 @@ import os
 from django.core.mail import send_mail
 from django.conf import settings
 from django.template import loader,RequestContext
+from django.core.cache import cache
 from celery import Celery
+from celery.signals import worker_process_init
 
-from goods.models import GoodsType, GoodsSKU, IndexGoodsBanner,IndexPromotionBanner,IndexTypeGoodsBanner
+from goods.index_page import get_index_data
+from goods import static_pages, rankings, search_signals
+from order import stock, sales, pay_poller
+from utils.static_files import write_static_file
+from utils.analyzer import warm_up
 
 
 app = Celery('celery_task.tasks',broker='redis://10.1.1.128:6379/9')
 
+# celery beat定时执行的任务
+app.conf.beat_schedule = {
+    'reconcile-stock': {
+        'task': 'celery_tasks.tasks.reconcile_stock',
+        'schedule': settings.STOCK_RECONCILE_INTERVAL,
+    },
+    'check-pending-payments': {
+        'task': 'celery_tasks.tasks.check_pending_payments',
+        'schedule': settings.PAY_CHECK_INTERVAL,
+    },
+    'flush-sales': {
+        'task': 'celery_tasks.tasks.flush_sales',
+        'schedule': settings.SALES_FLUSH_INTERVAL,
+    },
+    'update-search-index': {
+        'task': 'celery_tasks.tasks.update_search_index',
+        'schedule': settings.SEARCH_INDEX_INTERVAL,
+    },
+    'rebuild-rankings': {
+        'task': 'celery_tasks.tasks.rebuild_rankings',
+        'schedule': settings.RANKINGS_REBUILD_INTERVAL,
+    },
+}
+
+@worker_process_init.connect
+def load_analyzer(**kwargs):
+    '''worker进程启动时加载中文分词的词典,更新索引时不需要等待加载'''
+    warm_up()
+
+
 @app.task
 def send_reg_active_mail(to_email, username, token):
     subject = '天天生鲜欢迎信息'
@@ -25,35 +61,89 @@ def send_reg_active_mail(to_email, username, token):
     send_mail(subject, message, sender, receiver, html_message=html_message)
 
 
-@app.task
-def generate_static_index_html():
-    '''产生首页静态页面,不包含用户信息,给第一次访问站点的大量用户使用'''
+# 等待生成静态首页的标记,标记存在期间的修改不会重复发出任务
+STATIC_INDEX_PENDING_KEY = 'static_index_pending'
 
-    # 获取商品的种类信息
-    types = GoodsType.objects.all()
 
-    # 获取首页轮播商品信息
-    goods_banners = IndexGoodsBanner.objects.all().order_by('index')
+def schedule_static_index_html():
+    '''
+    首页数据被修改后调用,延迟STATIC_INDEX_DEBOUNCE秒生成静态首页,
+    这段时间内的多次修改(如批量修改轮播图)只生成一次
+    '''
+    # 多留60秒,防止worker繁忙时任务还没执行标记就过期了
+    if cache.add(STATIC_INDEX_PENDING_KEY, 1, settings.STATIC_INDEX_DEBOUNCE + 60):
+        generate_static_index_html.apply_async(countdown=settings.STATIC_INDEX_DEBOUNCE)
 
-    # 获取首页促销活动信息
-    promotion_banners = IndexPromotionBanner.objects.all().order_by('index')
 
-    # 获取首页分类商品展示信息,并给每个分类添加此分类下要展示的商品
-    for ctype in types:
-        ctype.image_banners = IndexTypeGoodsBanner.objects.filter(type=ctype, display_type=1).order_by('index')
-        ctype.title_banners = IndexTypeGoodsBanner.objects.filter(type=ctype, display_type=0).order_by('index')
+@app.task
+def generate_static_index_html():
+    '''产生首页静态页面,不包含用户信息,给第一次访问站点的大量用户使用'''
+    # 任务开始后的修改需要重新发出任务
+    cache.delete(STATIC_INDEX_PENDING_KEY)
 
-    context = {
-        'types': types,
-        'goods_banners': goods_banners,
-        'promotion_banners': promotion_banners
-    }
+    # 获取首页要展示的数据
+    context = get_index_data()
 
     # 获取并渲染模板,生成静态页面
     temp = loader.get_template('static_index.html')
     static_index_html = temp.render(context)
 
-    # 生成首页对应静态文件
+    # 生成首页对应静态文件,内容没有变化时不重新写入
     static_index_html_path = os.path.join(settings.BASE_DIR,'static/index.html')
-    with open(static_index_html_path,'w',encoding='utf-8') as f:
-        f.write(static_index_html)
\ No newline at end of file
+    return write_static_file(static_index_html_path, static_index_html, settings.STATIC_PRECOMPRESS)
+
+
+# 等待生成静态详情页和列表页的标记
+STATIC_PAGES_PENDING_KEY = 'static_pages_pending'
+
+
+def schedule_static_pages():
+    '''
+    商品被修改后调用,延迟STATIC_PAGES_DEBOUNCE秒生成需要重新生成的静态详情页和列表页,
+    这段时间内的多次修改只发出一次任务
+    '''
+    if cache.add(STATIC_PAGES_PENDING_KEY, 1, settings.STATIC_PAGES_DEBOUNCE + 60):
+        generate_static_pages.apply_async(countdown=settings.STATIC_PAGES_DEBOUNCE)
+
+
+@app.task
+def generate_static_pages():
+    '''重新生成被修改的商品相关的静态详情页和列表页,给没有登录的用户使用'''
+    cache.delete(STATIC_PAGES_PENDING_KEY)
+    return static_pages.generate_dirty_pages()
+
+
+@app.task
+def reconcile_stock():
+    '''把redis中扣减的商品库存同步到mysql中'''
+    return stock.reconcile_stock()
+
+
+@app.task
+def flush_sales():
+    '''把redis中累加的商品销量批量同步到mysql中'''
+    return sales.flush_sales()
+
+
+@app.task
+def check_pending_payments():
+    '''向支付宝查询一批等待支付的订单的支付结果'''
+    return pay_poller.check_pending_payments()
+
+
+@app.task
+def rebuild_rankings():
+    '''从mysql中重建所有种类的商品排行,修正增量更新可能产生的偏差'''
+    return rankings.rebuild_all()
+
+
+@app.task
+def rebuild_type_rankings(type_id):
+    '''从mysql中建立某个种类的商品排行,列表页发现种类的排行还没有建立时发出'''
+    return rankings.rebuild_type(type_id)
+
+
+@app.task
+def update_search_index():
+    '''批量更新被修改的商品的全文检索索引'''
+    return search_signals.update_dirty_index(settings.SEARCH_INDEX_BATCH_SIZE)
@@ -197,14 +197,98 @@ HAYSTACK_CONNECTIONS = {
     'default': {
         # 使用whoosh引擎
         # 'ENGINE': 'haystack.backends.whoosh_backend.WhooshEngine',
-        'ENGINE': 'haystack.backends.whoosh_cn_backend.WhooshEngine',
+        # 使用jieba中文分词的whoosh引擎,见utils/analyzer.py
+        'ENGINE': 'utils.whoosh_cn_backend.WhooshEngine',
         # 索引文件路径
         'PATH': os.path.join(BASE_DIR, 'whoosh_index'),
     }
 }
 
 # 当添加、修改、删除数据时，自动生成索引
-HAYSTACK_SIGNAL_PROCESSOR = 'haystack.signals.RealtimeSignalProcessor'
+HAYSTACK_SIGNAL_PROCESSOR = 'goods.search_signals.QueuedSignalProcessor'
 
 # 指定搜索结果每页显示的条数
-HAYSTACK_SEARCH_RESULTS_PER_PAGE=1
\ No newline at end of file
+HAYSTACK_SEARCH_RESULTS_PER_PAGE=1
+
+# 下单时在redis中扣减的库存,每隔多少秒同步一次到mysql中
+STOCK_RECONCILE_INTERVAL = 5
+# redis中商品库存计数器的过期秒数,过期后从mysql中重新加载,
+# 直接修改了mysql中的库存又没有删除计数器时,最多在这段时间后修正
+STOCK_COUNTER_TIMEOUT = 600
+
+# 支付宝支付配置
+# 调用支付宝接口的客户端类,测试时可以改为'order.tests.FakeAliPay',不访问网络
+ALIPAY_CLIENT_CLASS = 'alipay.AliPay'
+ALIPAY_APPID = '2016090800464054'
+ALIPAY_PRIVATE_KEY_PATH = os.path.join(BASE_DIR, 'apps/order/app_private_key.pem')
+# 支付宝的公钥，验证支付宝回传消息使用，不是你自己的公钥
+ALIPAY_PUBLIC_KEY_PATH = os.path.join(BASE_DIR, 'apps/order/alipay_public_key.pem')
+ALIPAY_DEBUG = True
+ALIPAY_GATEWAY_URL = 'https://openapi.alipaydev.com/gateway.do?'
+# 每隔多少秒检查一次密钥文件是否被替换,替换后重新加载密钥
+ALIPAY_KEY_CHECK_INTERVAL = 60
+
+# 后台查询支付结果的配置
+# celery每隔多少秒查询一批订单
+PAY_CHECK_INTERVAL = 3
+# 每批最多查询的订单数
+PAY_CHECK_BATCH_SIZE = 100
+# 第一次查询的延迟秒数,之后每次查询的间隔翻倍,最多不超过PAY_CHECK_MAX_DELAY秒
+PAY_CHECK_BASE_DELAY = 5
+PAY_CHECK_MAX_DELAY = 300
+# 查询多少次后放弃查询,用户再次查询支付结果时会重新开始
+PAY_CHECK_MAX_ATTEMPTS = 20
+
+# 用户中心订单页每页显示的订单数
+USER_ORDER_PAGE_SIZE = 5
+
+# 后台修改首页数据后,延迟多少秒生成静态首页,这段时间内的多次修改只生成一次
+STATIC_INDEX_DEBOUNCE = 10
+# 生成静态页面时,是否同时生成gzip/brotli压缩文件,给nginx的gzip_static/brotli_static使用
+STATIC_PRECOMPRESS = True
+
+# 商品被修改后,延迟多少秒重新生成静态详情页和列表页
+STATIC_PAGES_DEBOUNCE = 10
+
+# 商品列表页每页显示的商品数
+GOODS_LIST_PAGE_SIZE = 10
+# 商品sku快照的进程内缓存,最多缓存的商品数和过期秒数,
+# 商品修改后其他进程中的快照最多在这段时间后更新
+SKU_LOCAL_CACHE_SIZE = 1000
+SKU_LOCAL_CACHE_TTL = 5
+
+# 用户中心保存和显示的最近浏览商品数
+USER_HISTORY_LENGTH = 5
+
+# 商品详情页每页显示的评论数
+SKU_COMMENTS_PAGE_SIZE = 10
+
+# 每隔多少秒从mysql中重建一次redis中的种类商品排行
+RANKINGS_REBUILD_INTERVAL = 3600
+
+# 每隔多少秒把redis中累加的商品销量同步到mysql中
+SALES_FLUSH_INTERVAL = 60
+# 按天统计的销量保留多少天
+SALES_DAILY_KEEP = 60
+# 列表页按近期销量排序时,统计最近多少天的销量,不能超过SALES_DAILY_KEEP
+SALES_HOT_DAYS = 7
+
+# 每隔多少秒批量更新一次被修改的商品的全文检索索引,每批最多更新的商品数
+SEARCH_INDEX_INTERVAL = 10
+SEARCH_INDEX_BATCH_SIZE = 500
+
+# 搜索结果(商品id列表)的缓存秒数,每个查询词最多缓存的结果数
+SEARCH_CACHE_TIMEOUT = 60
+SEARCH_MAX_RESULTS = 1000
+# 统计查询次数时,查询词只记录前多少个字符,最多保留多少个查询词的次数
+SEARCH_QUERY_MAX_LENGTH = 32
+SEARCH_QUERIES_KEEP = 1000
+
+# jieba分词的词典缓存文件,部署时可以预先生成
+JIEBA_CACHE_FILE = os.path.join(BASE_DIR, 'whoosh_index', 'jieba.cache')
+# 缓存分词结果的文本数,和缓存的文本的最大长度(查询词较短,商品详情等长文本不缓存)
+JIEBA_MEMO_SIZE = 10000
+JIEBA_MEMO_MAX_LENGTH = 64
+
+# 搜索框的输入提示最多返回的商品数
+SUGGEST_LIMIT = 10
@@ -20,7 +20,6 @@ from django.conf.urls import url,include
 urlpatterns = [
     path('admin/', admin.site.urls),
     url(r'^tinymce/', include('tinymce.urls')),  # 富文本编辑器
-    url(r'search/',include('haystack.urls')), # 全文检索框架
     url(r'^user/', include(('user.urls','user'), namespace='user')),  # 用户模块
     url(r'^cart/', include(('cart.urls','cart'), namespace='cart')),  # 购物车模块
     url(r'^order/', include(('order.urls','order'), namespace='order')),  # 订单模块
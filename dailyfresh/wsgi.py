@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "dailyfresh.settings")
 
 application = get_wsgi_application()
+
+# 在worker启动时加载中文分词的词典,第一次搜索不需要等待加载
+from utils.analyzer import warm_up
+warm_up()
@@ -0,0 +1,73 @@
+'''
+全文检索使用的中文分词器,基于jieba:
+    1.jieba的词典缓存文件放在JIEBA_CACHE_FILE,不在每次启动时从词典文本重新生成,
+      可以在部署时预先生成(python manage.py benchmark_analyzer --build-cache)
+    2.worker启动时调用warm_up加载词典,第一次查询不需要等待几秒的加载时间
+    3.较短的文本(查询词)的分词结果用LRU缓存,相同的查询词不需要重复分词
+'''
+import re
+from functools import lru_cache
+
+import jieba
+from django.conf import settings
+from whoosh.analysis import Tokenizer, Token, LowercaseFilter, StopFilter, StemFilter
+from whoosh.lang.porter import stem
+
+# 和jieba.analyse.ChineseAnalyzer相同的停用词和字符规则
+STOP_WORDS = frozenset(('a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'can',
+                        'for', 'from', 'have', 'if', 'in', 'is', 'it', 'may',
+                        'not', 'of', 'on', 'or', 'tbd', 'that', 'the', 'this',
+                        'to', 'us', 'we', 'when', 'will', 'with', 'yet',
+                        'you', 'your', '的', '了', '和'))
+ACCEPTED_CHARS = re.compile(r'[\u4E00-\u9FD5]+')
+
+jieba.dt.cache_file = settings.JIEBA_CACHE_FILE
+
+
+def warm_up():
+    '''加载jieba的词典,词典缓存文件不存在时生成缓存文件'''
+    jieba.initialize()
+    tokenize('天天生鲜')
+
+
+def _tokenize(text):
+    return tuple((word, start, end) for word, start, end in jieba.tokenize(text, mode='search')
+                 if ACCEPTED_CHARS.match(word) or len(word) > 1)
+
+
+_tokenize_cached = lru_cache(maxsize=settings.JIEBA_MEMO_SIZE)(_tokenize)
+
+
+def tokenize(text):
+    '''
+    分词,返回(词, 起始位置, 结束位置)的元组,
+    长度不超过JIEBA_MEMO_MAX_LENGTH的文本使用缓存的结果,商品详情等长文本直接分词
+    '''
+    if len(text) <= settings.JIEBA_MEMO_MAX_LENGTH:
+        return _tokenize_cached(text)
+    return _tokenize(text)
+
+
+def memo_info():
+    '''分词结果缓存的命中次数等信息'''
+    return _tokenize_cached.cache_info()
+
+
+def clear_memo():
+    _tokenize_cached.cache_clear()
+
+
+class ChineseTokenizer(Tokenizer):
+    def __call__(self, text, **kwargs):
+        token = Token()
+        for word, start, end in tokenize(text):
+            token.original = token.text = word
+            token.pos = start
+            token.startchar = start
+            token.endchar = end
+            yield token
+
+
+def ChineseAnalyzer(stoplist=STOP_WORDS, minsize=1, stemfn=stem, cachesize=50000):
+    return (ChineseTokenizer() | LowercaseFilter() | StopFilter(stoplist=stoplist, minsize=minsize)
+            | StemFilter(stemfn=stemfn, ignore=None, cachesize=cachesize))
@@ -0,0 +1,60 @@
+import base64
+import json
+from datetime import datetime
+from decimal import Decimal
+
+from django.db.models import Q
+
+
+def encode_cursor(values):
+    '''
+    把上一页最后一条数据的排序字段值编码成可以放在url中的字符串
+    '''
+    values = [value.isoformat() if isinstance(value, datetime) else
+              str(value) if isinstance(value, Decimal) else value
+              for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor, length):
+    '''
+    解码encode_cursor生成的字符串,格式不正确时返回None
+    '''
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(values, list) or len(values) != length:
+        return None
+    return values
+
+
+def keyset_page(queryset, ordering, cursor, page_size):
+    '''
+    键集分页:根据上一页最后一条数据的排序字段值,直接定位到下一页的数据,
+    不需要像offset那样扫描前面所有页的数据,翻到很深的页时依然很快
+    :param ordering: 排序字段,如['-create_time', '-order_id'],最后一个字段必须是唯一的
+    :param cursor: encode_cursor生成的字符串,为空时返回第一页
+    :return: (当前页的数据列表, 下一页的cursor,没有下一页时为None)
+    '''
+    fields = [field.lstrip('-') for field in ordering]
+    values = decode_cursor(cursor, len(fields)) if cursor else None
+
+    if values is not None:
+        # (a < v1) or (a = v1 and b < v2) or ...
+        condition = Q()
+        for i, field in enumerate(ordering):
+            lookup = '__lt' if field.startswith('-') else '__gt'
+            kwargs = dict(zip(fields[:i], values[:i]))
+            kwargs[fields[i] + lookup] = values[i]
+            condition |= Q(**kwargs)
+        queryset = queryset.filter(condition)
+
+    # 多取一条数据,判断是否还有下一页
+    objects = list(queryset.order_by(*ordering)[:page_size + 1])
+    if len(objects) <= page_size:
+        return objects, None
+
+    objects = objects[:page_size]
+    last = objects[-1]
+    return objects, encode_cursor([getattr(last, field) for field in fields])
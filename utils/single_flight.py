@@ -0,0 +1,63 @@
+import time
+
+from django.core.cache import cache
+from django_redis import get_redis_connection
+from redis.exceptions import LockError
+
+# 数据还新鲜的标记的key,标记过期后数据变为陈旧数据,但仍然可以返回给用户
+FRESH_KEY = '%s_fresh'
+# 重新生成数据时使用的锁
+LOCK_KEY = 'single_flight_lock_%s'
+
+
+def get_or_rebuild(key, rebuild, timeout, stale_timeout=86400, lock_timeout=30, wait=5):
+    '''
+    带有防止缓存击穿(single-flight)和过期后仍返回旧数据(stale-while-revalidate)的缓存读取,
+    数据在timeout秒内是新鲜的,之后再保留stale_timeout秒的陈旧数据:
+        1.数据新鲜时直接返回
+        2.数据陈旧时,只有拿到锁的一个请求调用rebuild重新生成数据,其他请求直接返回陈旧数据
+        3.缓存中完全没有数据时,拿到锁的请求重新生成数据,其他请求最多等待wait秒
+    :param rebuild: 重新生成数据的函数,没有参数
+    :return: 缓存的数据
+    '''
+    fresh_key = FRESH_KEY % key
+    values = cache.get_many([key, fresh_key])
+    if key in values and fresh_key in values:
+        return values[key]
+
+    lock = get_redis_connection('default').lock(LOCK_KEY % key, timeout=lock_timeout)
+    if lock.acquire(blocking=False):
+        try:
+            value = rebuild()
+            cache.set(key, value, timeout + stale_timeout)
+            cache.set(fresh_key, 1, timeout)
+        finally:
+            try:
+                lock.release()
+            except LockError:
+                # 重新生成数据的时间超过了lock_timeout,锁已经过期,可能已经被其他请求拿到
+                pass
+        return value
+
+    # 其他请求正在重新生成数据,有陈旧数据时先返回陈旧数据
+    if key in values:
+        return values[key]
+
+    # 缓存中没有数据,等待其他请求生成的数据
+    deadline = time.time() + wait
+    while time.time() < deadline:
+        time.sleep(0.05)
+        value = cache.get(key)
+        if value is not None:
+            return value
+
+    # 等待超时,自己生成数据,但不写入缓存
+    return rebuild()
+
+
+def mark_stale(key):
+    '''
+    数据被修改后,把缓存的数据标记为陈旧数据,而不是直接删除,
+    下一次读取时由一个请求重新生成,其他请求继续使用陈旧数据
+    '''
+    cache.delete(FRESH_KEY % key)
@@ -0,0 +1,64 @@
+import gzip
+import hashlib
+import os
+import tempfile
+
+try:
+    import brotli
+except ImportError: # 没有安装brotli时只生成gzip压缩文件
+    brotli = None
+
+
+def _atomic_write(path, data):
+    '''
+    先写入同一目录下的临时文件,再重命名为目标文件,
+    nginx读取文件时不会读到写了一半的内容
+    '''
+    dirname = os.path.dirname(path)
+    os.makedirs(dirname, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix='.tmp_')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+def _file_md5(path):
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.md5(f.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def write_static_file(path, content, precompress=True):
+    '''
+    生成静态文件,内容没有变化时不重新写入,
+    precompress为True时同时生成gzip(.gz)和brotli(.br)压缩文件,给nginx的gzip_static/brotli_static使用
+    :param content: 文件内容(str)
+    :return: 文件是否被重新写入
+    '''
+    data = content.encode('utf-8')
+    if hashlib.md5(data).hexdigest() == _file_md5(path):
+        return False
+
+    if precompress:
+        # mtime=0使得相同的内容生成相同的压缩文件
+        _atomic_write(path + '.gz', gzip.compress(data, compresslevel=9, mtime=0))
+        if brotli is not None:
+            _atomic_write(path + '.br', brotli.compress(data))
+    _atomic_write(path, data)
+    return True
+
+
+def remove_static_file(path):
+    '''删除静态文件及其压缩文件'''
+    for filename in (path, path + '.gz', path + '.br'):
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
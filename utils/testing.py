@@ -0,0 +1,23 @@
+'''
+测试使用的公共类
+'''
+from django.conf import settings
+from django.test import TestCase, override_settings
+from django_redis import get_redis_connection
+
+# 测试使用单独的redis数据库(15),不影响开发时使用的数据
+TEST_CACHES = {
+    'default': dict(settings.CACHES['default'],
+                    LOCATION=settings.CACHES['default']['LOCATION'].rsplit('/', 1)[0] + '/15'),
+}
+
+
+@override_settings(CACHES=TEST_CACHES)
+class RedisTestCase(TestCase):
+    '''使用redis的测试,每个测试开始前和结束后清空测试使用的redis数据库'''
+    def setUp(self):
+        self.conn = get_redis_connection('default')
+        self.conn.flushdb()
+
+    def tearDown(self):
+        self.conn.flushdb()
@@ -0,0 +1,26 @@
+'''
+使用中文分词的whoosh搜索引擎,代替复制到haystack目录中的whoosh_cn_backend,
+和haystack自带的whoosh引擎的区别只是文本字段使用utils.analyzer.ChineseAnalyzer分词
+
+    HAYSTACK_CONNECTIONS = {'default': {'ENGINE': 'utils.whoosh_cn_backend.WhooshEngine', ...}}
+'''
+from haystack.backends import BaseEngine
+from haystack.backends.whoosh_backend import WhooshSearchBackend, WhooshSearchQuery
+from whoosh.fields import TEXT
+
+from utils.analyzer import ChineseAnalyzer
+
+
+class ChineseWhooshSearchBackend(WhooshSearchBackend):
+    def build_schema(self, fields):
+        content_field_name, schema = super().build_schema(fields)
+        analyzer = ChineseAnalyzer()
+        for name, field in schema.items():
+            if isinstance(field, TEXT):
+                field.analyzer = analyzer
+        return content_field_name, schema
+
+
+class WhooshEngine(BaseEngine):
+    backend = ChineseWhooshSearchBackend
+    query = WhooshSearchQuery